@@ -1,4 +0,0 @@
-from . import main
-from . import database
-from . import services
-from . import utils
@@ -1,10 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
 
 from ..main import app
-from ..utils.logging import Log
 
+# Engine создаётся при первом обращении к db.engine, а не при импорте
 db = SQLAlchemy(app)
-logger = Log()
-logger.log("PRODUCER DB {0}".format(db))
+
+from .routing import create_read_session
+
+# Сессия для тяжёлых чтений (статистика, списки); записи и захват задач -
+# только через db.session
+read_session = create_read_session(db, app)
+
 from . import models
 from . import tasks_dao
+from . import schema
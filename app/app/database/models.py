@@ -1,6 +1,7 @@
 import enum
 
-from sqlalchemy import VARCHAR, Boolean, Column, DateTime, ForeignKey, Integer
+from sqlalchemy import (VARCHAR, Boolean, Column, DateTime, ForeignKey, Index,
+                        Integer, text)
 from sqlalchemy.dialects.postgresql import ENUM
 from sqlalchemy.orm import relationship
 
@@ -83,16 +84,40 @@ class Content(db.Model):
 
 class Subtask(db.Model):
     __tablename__ = 'subtasks'
+    __table_args__ = (
+        Index(
+            'ix_subtasks_backlog',
+            'subtask_type',
+            'id',
+            postgresql_where=text("status IS NULL OR status = 'retry'")
+        ),
+        Index(
+            'ix_subtasks_lease',
+            'lease_expires_at',
+            postgresql_where=text("status IN ('in_queue', 'in_progress')")
+        ),
+        Index('ix_subtasks_task', 'task_id', 'status', 'subtask_type'),
+    )
     id = Column('id', Integer, primary_key=True)
     post_id = Column(Integer, ForeignKey('posts.id'))
+    # Копия posts.task_id, которую поддерживают триггеры (schema.SCHEMA_UPGRADES)
+    task_id = Column('task_id', Integer)
     subtask_type = Column(ENUM(SubtaskType))
     start_time = Column('start_time', DateTime)
     end_time = Column('end_time', DateTime)
     status = Column(ENUM(TaskStatus))
+    lease_expires_at = Column('lease_expires_at', DateTime)
 
 
 class Task(db.Model):
     __tablename__ = 'tasks'
+    __table_args__ = (
+        Index(
+            'ix_tasks_lease',
+            'lease_expires_at',
+            postgresql_where=text("status IN ('in_queue', 'in_progress')")
+        ),
+    )
     id = Column('id', Integer, primary_key=True)
     interval = Column('interval', Integer)
     retro = Column('retro', DateTime)
@@ -103,6 +128,7 @@ class Task(db.Model):
     status = Column('status', ENUM(TaskStatus))
     enabled = Column('enabled', Boolean)
     priority = Column('priority', Integer)
+    lease_expires_at = Column('lease_expires_at', DateTime)
 
 
 class Comment(db.Model):
@@ -134,6 +160,9 @@ class Like(db.Model):
 
 class TaskKeyword(db.Model):
     __tablename__ = 'tasks_keyword'
+    __table_args__ = (
+        Index('ux_tasks_keyword_keyword', 'keyword', unique=True),
+    )
     id = Column('id', Integer, primary_key=True)
     keyword = Column('keyword', VARCHAR(255))
     task_id = Column(Integer, ForeignKey('tasks.id'))
@@ -142,6 +171,9 @@ class TaskKeyword(db.Model):
 
 class TaskSource(db.Model):
     __tablename__ = 'tasks_source'
+    __table_args__ = (
+        Index('ux_tasks_source_source_id', 'source_id', unique=True),
+    )
     id = Column('id', Integer, primary_key=True)
     source_id = Column('source_id', VARCHAR(1024))
     task_id = Column(Integer, ForeignKey('tasks.id'))
@@ -0,0 +1,61 @@
+"""Правила готовности задач к отправке: уровни, давности и порядок очереди.
+
+Общие для ready_tasks_subquery и симулятора планировщика
+(benchmark.simulator): оба собирают условия уровней и порядок из этих
+таблиц, поэтому правила не расходятся.
+"""
+from datetime import timedelta
+
+# Приоритеты задач: 1 - наивысший; задачи без приоритета или с неизвестным
+# приоритетом идут как самые низкие
+TASK_PRIORITIES = (1, 2, 3)
+DEFAULT_TASK_PRIORITY = 3
+# Приоритеты, которые после завершения ждут FINISHED_BEFORE; задачи без
+# приоритета ждут так же, приоритет 1 не ждёт
+DELAYED_PRIORITIES = (2, 3)
+
+# Пауза перед повторной отправкой задачи в retry и давность завершения, после
+# которой задачи приоритетов 2 и 3 снова готовы. Запасной уровень проверяет
+# обе давности (FALLBACK_FINISHED_BEFORE и FINISHED_BEFORE), как и раньше
+RETRY_DELAY = timedelta(minutes=3)
+FINISHED_BEFORE = timedelta(days=2)
+FALLBACK_FINISHED_BEFORE = timedelta(days=1)
+
+READINESS_TIERS = {
+    1: 'new',
+    2: 'retry',
+    3: 'success_repeat',
+    4: 'fallback',
+}
+
+# Условия уровней в порядке проверки: задача получает первый уровень, все
+# проверки которого проходят. Проверка - имя и параметр:
+#   new - задача ещё не отправлялась;
+#   retry - задача в retry, с завершения прошло больше параметра;
+#   interval_passed - успешная включённая задача, интервал которой прошёл;
+#   finished_before - приоритет 1 или с завершения прошло больше параметра
+TIER_CONDITIONS = {
+    1: (('new', None), ('finished_before', FINISHED_BEFORE)),
+    2: (('retry', RETRY_DELAY),),
+    3: (('interval_passed', None), ('finished_before', FINISHED_BEFORE)),
+    4: (('interval_passed', None), ('finished_before', FALLBACK_FINISHED_BEFORE),
+        ('finished_before', FINISHED_BEFORE)),
+}
+
+# Порядок внутри приоритета и уровня: сначала поля уровня (новые - по id,
+# retry - по received_time), затем общие для всех. Пустые значения - в конце
+TIER_ORDER = {
+    1: ('id',),
+    2: ('received_time',),
+}
+TIER_ORDER_TIEBREAK = ('finish_time', 'id')
+
+
+def task_priority(priority):
+    """Приоритет, по которому задача ранжируется и делит квоты."""
+    return priority if priority in TASK_PRIORITIES else DEFAULT_TASK_PRIORITY
+
+
+def tier_order_columns(tier):
+    """Поля порядка задач уровня tier."""
+    return TIER_ORDER.get(tier, ()) + TIER_ORDER_TIEBREAK
@@ -0,0 +1,107 @@
+import itertools
+import threading
+import time
+
+from flask import _app_ctx_stack
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import create_engine, orm, text
+
+from ..main import logger
+
+# Отставание реплики в секундах; 0, если реплика догнала основную БД или
+# сервер не является репликой
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ReplicaRouter:
+    """Выбор реплики для чтения с ограниченным отставанием.
+
+    Реплики перебираются по кругу. Отставание каждой проверяется не чаще раза
+    в check_interval секунд; реплика, которая отстаёт больше max_lag секунд
+    или недоступна, пропускается. Если подходящих реплик нет, get_engine
+    возвращает None и чтение идёт в основную БД.
+    """
+
+    def __init__(self, uris, max_lag, check_interval, engine_options=None, clock=time.monotonic):
+        self.uris = uris
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.engine_options = engine_options or {}
+        self.clock = clock
+        self.engines = {}
+        self.lags = {}
+        self.lock = threading.Lock()
+        self.order = itertools.cycle(range(len(uris)))
+
+    def get_engine(self):
+        with self.lock:
+            start = next(self.order)
+        for offset in range(len(self.uris)):
+            uri = self.uris[(start + offset) % len(self.uris)]
+            if self.get_lag(uri) <= self.max_lag:
+                return self.engines[uri]
+        return None
+
+    def get_lag(self, uri):
+        with self.lock:
+            if uri not in self.engines:
+                self.engines[uri] = create_engine(uri, **self.engine_options)
+            checked_at, lag = self.lags.get(uri, (None, None))
+            if checked_at is not None and self.clock() - checked_at < self.check_interval:
+                return lag
+
+        replica = repr(self.engines[uri].url)
+        try:
+            with self.engines[uri].connect() as connection:
+                lag = float(connection.execute(text(REPLICA_LAG_QUERY)).scalar())
+        except Exception as error:
+            logger.item("replica_unavailable", "replica is not available", replica=replica,
+                        error=str(error))
+            lag = float('inf')
+        else:
+            if lag > self.max_lag:
+                logger.item("replica_lag", "replica is lagging", replica=replica, lag=round(lag, 3))
+
+        with self.lock:
+            self.lags[uri] = (self.clock(), lag)
+        return lag
+
+
+class ReadSession(SignallingSession):
+    """Сессия только для чтения: запросы уходят в реплику или в основную БД."""
+
+    def __init__(self, db, router, **options):
+        self.router = router
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        return self.router.get_engine() or super().get_bind(mapper, clause)
+
+
+def create_read_session(db, app):
+    """Сессия для тяжёлых чтений; без DATABASE_REPLICA_URIS - db.session."""
+    if not app.config['DATABASE_REPLICA_URIS']:
+        return db.session
+
+    router = ReplicaRouter(
+        app.config['DATABASE_REPLICA_URIS'],
+        max_lag=app.config['DATABASE_REPLICA_MAX_LAG'],
+        check_interval=app.config['DATABASE_REPLICA_CHECK_INTERVAL'],
+        engine_options=app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    )
+    session = orm.scoped_session(
+        orm.sessionmaker(class_=ReadSession, db=db, router=router, query_cls=db.Query,
+                         autoflush=False),
+        scopefunc=_app_ctx_stack.__ident_func__
+    )
+
+    @app.teardown_appcontext
+    def remove_read_session(exception=None):
+        session.remove()
+
+    return session
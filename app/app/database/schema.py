@@ -0,0 +1,302 @@
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from ..database import db
+from ..main import LEASE_TIMEOUT
+
+DISPATCH_NOTIFY_CHANNEL = 'fb_producer_dispatch'
+
+# Уведомления в канал DISPATCH_NOTIFY_CHANNEL о задачах и подзадачах,
+# которые могли стать готовыми к отправке. Формат сообщения:
+# "task:<task_id>" или "subtask:<subtask_type>:<subtask_id>".
+DISPATCH_NOTIFY_TRIGGERS = [
+    """
+    CREATE OR REPLACE FUNCTION fb_producer_notify_task() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+            RETURN NEW;
+        END IF;
+        IF NEW.status IS NULL OR NEW.status = 'retry' THEN
+            PERFORM pg_notify('fb_producer_dispatch', 'task:' || NEW.id);
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS fb_producer_notify_task ON tasks",
+    """
+    CREATE TRIGGER fb_producer_notify_task
+    AFTER INSERT OR UPDATE OF status ON tasks
+    FOR EACH ROW EXECUTE PROCEDURE fb_producer_notify_task()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION fb_producer_notify_task_type() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('fb_producer_dispatch', 'task:' || NEW.task_id);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS fb_producer_notify_task_keyword ON tasks_keyword",
+    """
+    CREATE TRIGGER fb_producer_notify_task_keyword
+    AFTER INSERT ON tasks_keyword
+    FOR EACH ROW EXECUTE PROCEDURE fb_producer_notify_task_type()
+    """,
+    "DROP TRIGGER IF EXISTS fb_producer_notify_task_source ON tasks_source",
+    """
+    CREATE TRIGGER fb_producer_notify_task_source
+    AFTER INSERT ON tasks_source
+    FOR EACH ROW EXECUTE PROCEDURE fb_producer_notify_task_type()
+    """,
+    """
+    CREATE OR REPLACE FUNCTION fb_producer_notify_subtask() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+            RETURN NEW;
+        END IF;
+        IF NEW.status IS NULL OR NEW.status = 'retry' THEN
+            PERFORM pg_notify('fb_producer_dispatch', 'subtask:' || NEW.subtask_type || ':' || NEW.id);
+        END IF;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS fb_producer_notify_subtask ON subtasks",
+    """
+    CREATE TRIGGER fb_producer_notify_subtask
+    AFTER INSERT OR UPDATE OF status ON subtasks
+    FOR EACH ROW EXECUTE PROCEDURE fb_producer_notify_subtask()
+    """,
+]
+
+# Столбцы и индексы, которые нужны запросам продюсера. Индексы строятся
+# CONCURRENTLY, поэтому выражения выполняются вне транзакции и не блокируют
+# запись в таблицы.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS lease_expires_at timestamp",
+    "ALTER TABLE subtasks ADD COLUMN IF NOT EXISTS lease_expires_at timestamp",
+    # subtasks.task_id - копия posts.task_id: заполняется триггером при вставке
+    # подзадачи и смене её поста, обновляется при смене задачи поста; строки,
+    # созданные до триггера, заполняет backfill_subtask_task_ids
+    "ALTER TABLE subtasks ADD COLUMN IF NOT EXISTS task_id integer",
+    """
+    CREATE OR REPLACE FUNCTION fb_producer_subtask_task_id() RETURNS trigger AS $$
+    BEGIN
+        SELECT task_id INTO NEW.task_id FROM posts WHERE id = NEW.post_id;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'fb_producer_subtask_task_id') THEN
+            CREATE TRIGGER fb_producer_subtask_task_id
+            BEFORE INSERT OR UPDATE OF post_id ON subtasks
+            FOR EACH ROW EXECUTE PROCEDURE fb_producer_subtask_task_id();
+        END IF;
+    END;
+    $$
+    """,
+    """
+    CREATE OR REPLACE FUNCTION fb_producer_post_task_id() RETURNS trigger AS $$
+    BEGIN
+        UPDATE subtasks SET task_id = NEW.task_id WHERE post_id = NEW.id;
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'fb_producer_post_task_id') THEN
+            CREATE TRIGGER fb_producer_post_task_id
+            AFTER UPDATE OF task_id ON posts
+            FOR EACH ROW WHEN (OLD.task_id IS DISTINCT FROM NEW.task_id)
+            EXECUTE PROCEDURE fb_producer_post_task_id();
+        END IF;
+    END;
+    $$
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS fb_producer_backfills (
+        name varchar(64) PRIMARY KEY,
+        last_id integer NOT NULL DEFAULT 0,
+        finished boolean NOT NULL DEFAULT false
+    )
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_subtasks_backlog
+    ON subtasks (subtask_type, id)
+    WHERE status IS NULL OR status = 'retry'
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tasks_lease
+    ON tasks (lease_expires_at)
+    WHERE status IN ('in_queue', 'in_progress')
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_subtasks_lease
+    ON subtasks (lease_expires_at)
+    WHERE status IN ('in_queue', 'in_progress')
+    """,
+    # Задачи и подзадачи, отправленные до появления аренды, получают аренду
+    # от момента обновления, иначе reclaim_expired_leases их не вернёт
+    """
+    UPDATE tasks SET lease_expires_at = now() + interval '{0} minutes'
+    WHERE status = 'in_queue' AND lease_expires_at IS NULL
+    """.format(LEASE_TIMEOUT),
+    """
+    UPDATE subtasks SET lease_expires_at = now() + interval '{0} minutes'
+    WHERE status = 'in_queue' AND lease_expires_at IS NULL
+    """.format(LEASE_TIMEOUT),
+    # Нужны для ON CONFLICT массовой загрузки. Если в таблице уже есть дубли,
+    # индекс остаётся невалидным: дубли нужно удалить, а индекс - пересоздать
+    """
+    CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_tasks_keyword_keyword
+    ON tasks_keyword (keyword)
+    """,
+    """
+    CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_tasks_source_source_id
+    ON tasks_source (source_id)
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_subtasks_task
+    ON subtasks (task_id, status, subtask_type)
+    """,
+]
+
+SUBTASK_TASK_ID_BACKFILL = 'subtasks.task_id'
+BACKFILL_BATCH_SIZE = 10000
+# Как часто перепроверять незавершённое заполнение, сек.
+BACKFILL_CHECK_INTERVAL = 60
+
+_finished_backfills = set()
+_backfill_checks = {}
+_backfill_lock = threading.Lock()
+
+# Один диапазон id подзадач и запись прогресса - одним запросом, чтобы
+# прогресс не расходился с данными
+SUBTASK_TASK_ID_BACKFILL_BATCH = """
+    WITH updated AS (
+        UPDATE subtasks SET task_id = posts.task_id
+        FROM posts
+        WHERE posts.id = subtasks.post_id
+            AND subtasks.id > :last_id AND subtasks.id <= :next_id
+            AND subtasks.task_id IS NULL
+        RETURNING 1
+    )
+    UPDATE fb_producer_backfills SET last_id = :next_id
+    WHERE name = :name
+    RETURNING (SELECT count(*) FROM updated)
+"""
+
+
+def apply_schema(statements):
+    """Применение идемпотентных DDL-выражений одной транзакцией."""
+    with db.engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+
+
+def apply_schema_upgrades(statements):
+    """Выполнение DDL вне транзакции (для CREATE INDEX CONCURRENTLY)."""
+    with db.engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        for statement in statements:
+            connection.execute(text(statement))
+
+
+def backfill_subtask_task_ids(batch_size=BACKFILL_BATCH_SIZE, max_batches=None):
+    """Заполнение subtasks.task_id у подзадач, созданных до триггера.
+
+    Идёт диапазонами id по batch_size, каждый диапазон - отдельная
+    транзакция; за вызов - не больше max_batches диапазонов. Прогресс
+    хранится в fb_producer_backfills: следующий вызов (и перезапуск)
+    продолжает с места остановки, после завершения заполнение не
+    повторяется. Должно выполняться после SCHEMA_UPGRADES, когда триггер уже
+    заполняет новые подзадачи. Возвращает количество обновлённых строк.
+    """
+    with db.engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        connection.execute(
+            text("INSERT INTO fb_producer_backfills (name) VALUES (:name) ON CONFLICT DO NOTHING"),
+            name=SUBTASK_TASK_ID_BACKFILL
+        )
+        last_id, finished = connection.execute(
+            text("SELECT last_id, finished FROM fb_producer_backfills WHERE name = :name"),
+            name=SUBTASK_TASK_ID_BACKFILL
+        ).first()
+        if finished:
+            return 0
+
+        max_id = connection.execute(text("SELECT max(id) FROM subtasks")).scalar() or 0
+        updated = 0
+        batches = 0
+        while last_id < max_id and (max_batches is None or batches < max_batches):
+            next_id = min(last_id + batch_size, max_id)
+            updated += connection.execute(
+                text(SUBTASK_TASK_ID_BACKFILL_BATCH),
+                last_id=last_id,
+                next_id=next_id,
+                name=SUBTASK_TASK_ID_BACKFILL
+            ).scalar()
+            last_id = next_id
+            batches += 1
+
+        if last_id >= max_id:
+            connection.execute(
+                text("UPDATE fb_producer_backfills SET finished = true WHERE name = :name"),
+                name=SUBTASK_TASK_ID_BACKFILL
+            )
+        return updated
+
+
+def get_unusable_indexes(names):
+    """Индексы из names, которых нет или которые невалидны.
+
+    Невалидным индекс остаётся после неудачного CREATE INDEX CONCURRENTLY
+    (например, из-за дублей), и IF NOT EXISTS его больше не пересоздаёт.
+    """
+    valid = {name for name, in db.session.execute(text(
+        """
+        SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = ANY(:names) AND i.indisvalid AND pg_table_is_visible(c.oid)
+        """
+    ), {'names': list(names)})}
+    return [name for name in names if name not in valid]
+
+
+def is_backfill_finished(name):
+    """Завершено ли заполнение name.
+
+    Завершённое заполнение запоминается до конца работы процесса,
+    незавершённое перепроверяется не чаще раза в BACKFILL_CHECK_INTERVAL
+    секунд. Без таблицы fb_producer_backfills (обновления схемы не
+    применялись) заполнение считается незавершённым.
+    """
+    with _backfill_lock:
+        if name in _finished_backfills:
+            return True
+        checked_at = _backfill_checks.get(name)
+        if checked_at is not None and time.monotonic() - checked_at < BACKFILL_CHECK_INTERVAL:
+            return False
+        _backfill_checks[name] = time.monotonic()
+
+    try:
+        with db.engine.connect() as connection:
+            finished = connection.execute(
+                text("SELECT finished FROM fb_producer_backfills WHERE name = :name"),
+                name=name
+            ).scalar()
+    except ProgrammingError:
+        finished = False
+
+    if finished:
+        with _backfill_lock:
+            _finished_backfills.add(name)
+    return bool(finished)
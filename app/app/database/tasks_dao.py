@@ -1,16 +1,67 @@
+import csv
+import functools
+import tempfile
+import threading
+import time
 from datetime import datetime, timedelta
 
 from dateutil import parser
 
-from sqlalchemy import false, or_, text, true, desc
+from sqlalchemy import (Interval, and_, case, column, desc, false, func,
+                        literal_column, or_, select, table, text, true)
+from sqlalchemy.dialects.postgresql import insert
 
-from ..database import db
+from ..database import db, read_session
 from ..database.models import (Post, Subtask, SubtaskType, Task, TaskKeyword,
                                TaskSource, TaskStatus, User, WorkerCredential)
-from ..main import (TIMEOUT_BETWEEN_ACCOUNTS_WORK,
+from ..database.readiness import (DEFAULT_TASK_PRIORITY, DELAYED_PRIORITIES,
+                                  READINESS_TIERS, TASK_PRIORITIES,
+                                  TIER_CONDITIONS, TIER_ORDER,
+                                  TIER_ORDER_TIEBREAK)
+from ..database.schema import SUBTASK_TASK_ID_BACKFILL, is_backfill_finished
+from ..main import (LEASE_TIMEOUT, SUBTASKS_STATISTICS_CACHE_TTL,
+                    TIMEOUT_BETWEEN_ACCOUNTS_WORK,
                     TIMEOUT_BETWEEN_RETRY_SEND,
                     logger)
 
+MINUTE = literal_column("interval '1 minute'", Interval)
+
+# Промежуточная таблица массовой загрузки. id задач выдаются заранее из
+# последовательности tasks, чтобы связать задачи с ключевыми словами или
+# источниками в одном запросе
+BULK_STAGING_TABLE = """
+    CREATE TEMPORARY TABLE bulk_tasks (
+        position serial,
+        value varchar(1024),
+        interval integer,
+        retro timestamp,
+        until timestamp,
+        enabled boolean,
+        task_id integer DEFAULT nextval(pg_get_serial_sequence('tasks', 'id'))
+    ) ON COMMIT DROP
+"""
+BULK_COPY = """
+    COPY bulk_tasks (value, interval, retro, until, enabled)
+    FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (value))
+"""
+bulk_tasks = table('bulk_tasks', column('position'), column('value'), column('interval'),
+                   column('retro'), column('until'), column('enabled'), column('task_id'))
+
+# Размер страницы постраничных списков и пачки строк серверного курсора при
+# потоковом обходе
+LISTING_PAGE_SIZE = 1000
+LISTING_BATCH_SIZE = 1000
+
+# Объём загружаемых строк, после которого буфер COPY сбрасывается на диск
+BULK_SPOOL_SIZE = 16 * 1024 * 1024
+
+_subtasks_statistics_cache = {}
+_subtasks_statistics_lock = threading.Lock()
+
+# Позиция обхода очереди подзадач по типам: id, ниже которого продолжать захват
+_subtask_cursors = {}
+_subtask_cursors_lock = threading.Lock()
+
 
 def create_task(data):
     """Создание задачи в БД."""
@@ -70,6 +121,70 @@ def create_source(data):
     return source
 
 
+def bulk_create_keywords(rows):
+    """Массовое добавление ключевых слов; rows - словари как у create_keyword."""
+    return bulk_create_tasks(TaskKeyword.__table__.c.keyword, 'keyword', rows)
+
+
+def bulk_create_sources(rows):
+    """Массовое добавление источников; rows - словари как у create_source."""
+    return bulk_create_tasks(TaskSource.__table__.c.source_id, 'source_id', rows)
+
+
+def bulk_create_tasks(type_column, value_key, rows):
+    """Загрузка задач через COPY и вставка одним запросом в одной транзакции.
+
+    Уже существующие и повторяющиеся значения type_column пропускаются по
+    уникальному индексу (ON CONFLICT DO NOTHING), из повторов во входных
+    данных остаётся первый. Возвращает {'inserted': ..., 'skipped': ...}.
+    """
+    # retro при загрузке обычно повторяется, а разбор даты - самая дорогая
+    # часть подготовки строк
+    parse_datetime = functools.lru_cache(maxsize=1024)(parser.parse)
+    with tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_SIZE, mode='w+') as buffer:
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([
+                row[value_key],
+                row['interval'],
+                parse_datetime(row['retro']).isoformat(),
+                row.get('until'),
+                row['enabled'],
+            ])
+        buffer.seek(0)
+
+        connection = db.session.connection()
+        connection.execute(text(BULK_STAGING_TABLE))
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(BULK_COPY, buffer)
+        total = cursor.rowcount
+
+    type_table = type_column.table
+    inserted_types = insert(type_table).from_select(
+        [type_column.name, 'task_id'],
+        select([bulk_tasks.c.value, bulk_tasks.c.task_id]).order_by(bulk_tasks.c.position)
+    ).on_conflict_do_nothing(
+        index_elements=[type_column]
+    ).returning(type_table.c.task_id).cte('inserted_types')
+
+    # Ограничение внешнего ключа проверяется в конце запроса, когда задачи
+    # уже вставлены
+    result = connection.execute(Task.__table__.insert().from_select(
+        ['id', 'interval', 'retro', 'until', 'enabled'],
+        select([
+            bulk_tasks.c.task_id,
+            bulk_tasks.c.interval,
+            bulk_tasks.c.retro,
+            bulk_tasks.c.until,
+            bulk_tasks.c.enabled,
+        ]).select_from(
+            bulk_tasks.join(inserted_types, inserted_types.c.task_id == bulk_tasks.c.task_id)
+        )
+    ))
+    db.session.commit()
+    return {'inserted': result.rowcount, 'skipped': total - result.rowcount}
+
+
 def patch_source(task_type, data):
     if 'source_id' in data:
         task_type.source_id = data['source_id']
@@ -78,16 +193,72 @@ def patch_source(task_type, data):
     return task_type
 
 
-def get_tasks():
-    return Task.query.all()
+def get_tasks(columns=None):
+    return listing_query(Task, columns).all()
+
+
+def iter_tasks(columns=None, batch_size=LISTING_BATCH_SIZE):
+    return stream(listing_query(Task, columns), batch_size)
+
+
+def get_tasks_page(after_id=None, limit=LISTING_PAGE_SIZE, columns=None):
+    return get_page(listing_query(Task, columns), Task.id, after_id, limit)
+
+
+def get_task_sources(columns=None):
+    return listing_query(TaskSource, columns).all()
+
+
+def iter_task_sources(columns=None, batch_size=LISTING_BATCH_SIZE):
+    return stream(listing_query(TaskSource, columns), batch_size)
+
+
+def get_task_sources_page(after_id=None, limit=LISTING_PAGE_SIZE, columns=None):
+    return get_page(listing_query(TaskSource, columns), TaskSource.id, after_id, limit)
+
+
+def get_task_keywords(columns=None):
+    return listing_query(TaskKeyword, columns).all()
+
+
+def iter_task_keywords(columns=None, batch_size=LISTING_BATCH_SIZE):
+    return stream(listing_query(TaskKeyword, columns), batch_size)
+
+
+def get_task_keywords_page(after_id=None, limit=LISTING_PAGE_SIZE, columns=None):
+    return get_page(listing_query(TaskKeyword, columns), TaskKeyword.id, after_id, limit)
+
+
+def listing_query(model, columns=None):
+    """Запрос списка: объекты model или только столбцы columns.
 
+    С columns строки - кортежи с доступом по имени, id всегда первый.
+    """
+    if columns is None:
+        return read_session.query(model)
+    names = ['id'] + [name for name in columns if name != 'id']
+    return read_session.query(*[getattr(model, name) for name in names])
 
-def get_task_sources():
-    return TaskSource.query.all()
 
+def stream(query, batch_size):
+    """Обход результата серверным курсором: в памяти не больше batch_size строк.
 
-def get_task_keywords():
-    return TaskKeyword.query.all()
+    Курсор открывается на основной БД, а не на реплике: долгий запрос на
+    hot standby отменяется при конфликте с восстановлением, и обход
+    оборвался бы на середине. Итератор действителен только внутри контекста
+    приложения, в котором создан: при выходе из него сессия закрывается
+    вместе с курсором.
+    """
+    return iter(query.with_session(db.session()).yield_per(batch_size))
+
+
+def get_page(query, id_column, after_id, limit):
+    """Страница по ключу id: (строки, after_id следующей страницы или None)."""
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    rows = query.order_by(id_column).limit(limit).all()
+    next_after_id = rows[-1].id if len(rows) == limit else None
+    return rows, next_after_id
 
 
 def has_task_source_by_source_id(source_id):
@@ -117,143 +288,424 @@ def get_task(task_id):
     return task_query.first()
 
 
-def get_subtasks(task_id):
-    subtasks = db.session.query(Subtask).join(
-        Post,
-        Post.id == Subtask.post_id
-    ).join(
-        Task,
-        Task.id == Post.task_id
-    ).filter(Task.id == task_id).all()
+def get_subtasks(task_id, columns=None):
+    return task_subtasks_query(task_id, columns).all()
 
-    return subtasks
 
+def iter_subtasks(task_id, columns=None, batch_size=LISTING_BATCH_SIZE):
+    return stream(task_subtasks_query(task_id, columns), batch_size)
 
-def get_subtasks_statistics(task_id):
-    def get_base_query():
-        return db.session.query(Subtask).join(
-            Post,
-            Post.id == Subtask.post_id
-        ).filter(Post.task_id == task_id)
-
-    all = get_base_query().count()
-    in_progress = get_base_query().filter(
-        Subtask.status == TaskStatus.in_progress
-    ).count()
-    failed = get_base_query().filter(Subtask.status == TaskStatus.failed).count()
-    success = get_base_query().filter(Subtask.status == TaskStatus.success).count()
 
-    comments = get_base_query().filter(
-        Subtask.subtask_type == SubtaskType.comment
-    ).count()
-    shares = get_base_query().filter(
-        Subtask.subtask_type == SubtaskType.share
-    ).count()
-    likes = get_base_query().filter(
-        Subtask.subtask_type == SubtaskType.like
-    ).count()
-    users = get_base_query().filter(
-        Subtask.subtask_type == SubtaskType.personal_page
-    ).count()
+def get_subtasks_page(task_id, after_id=None, limit=LISTING_PAGE_SIZE, columns=None):
+    return get_page(task_subtasks_query(task_id, columns), Subtask.id, after_id, limit)
+
+
+def task_subtasks_query(task_id, columns=None):
+    query, task_id_column = join_subtask_task(listing_query(Subtask, columns))
+    return query.filter(task_id_column == task_id)
+
 
-    return all, in_progress, failed, success, comments, shares, likes, users
+def join_subtask_task(query):
+    """Запрос подзадач и столбец с id их задачи.
+
+    Пока backfill_subtask_task_ids не завершён, у старых подзадач
+    subtasks.task_id пуст, поэтому задача берётся через posts.
+    """
+    if is_backfill_finished(SUBTASK_TASK_ID_BACKFILL):
+        return query, Subtask.task_id
+    return query.join(Post, Post.id == Subtask.post_id), Post.task_id
+
+
+def subtasks_statistics_columns():
+    """Все счётчики статистики подзадач для одного прохода по таблице."""
+    return (
+        func.count(),
+        func.count().filter(Subtask.status == TaskStatus.in_progress),
+        func.count().filter(Subtask.status == TaskStatus.failed),
+        func.count().filter(Subtask.status == TaskStatus.success),
+        func.count().filter(Subtask.subtask_type == SubtaskType.comment),
+        func.count().filter(Subtask.subtask_type == SubtaskType.share),
+        func.count().filter(Subtask.subtask_type == SubtaskType.like),
+        func.count().filter(Subtask.subtask_type == SubtaskType.personal_page),
+    )
+
+
+def get_subtasks_statistics(task_id):
+    """Статистика подзадач задачи одним агрегирующим запросом."""
+    statistics = get_cached_subtasks_statistics(task_id)
+    if statistics is not None:
+        return statistics
+
+    query, task_id_column = join_subtask_task(read_session.query(*subtasks_statistics_columns()))
+    statistics = tuple(query.filter(task_id_column == task_id).one())
+
+    cache_subtasks_statistics(task_id, statistics)
+    return statistics
+
+
+def get_subtasks_statistics_batch(task_ids):
+    """Статистика подзадач сразу для нескольких задач: {task_id: статистика}."""
+    statistics = {}
+    missing_task_ids = []
+    for task_id in task_ids:
+        cached = get_cached_subtasks_statistics(task_id)
+        if cached is not None:
+            statistics[task_id] = cached
+        else:
+            missing_task_ids.append(task_id)
+
+    if missing_task_ids:
+        query, task_id_column = join_subtask_task(read_session.query(Subtask.id))
+        rows = query.with_entities(task_id_column, *subtasks_statistics_columns()).filter(
+            task_id_column.in_(missing_task_ids)
+        ).group_by(task_id_column).all()
+        found = {row[0]: tuple(row[1:]) for row in rows}
+
+        for task_id in missing_task_ids:
+            task_statistics = found.get(task_id, (0,) * 8)
+            cache_subtasks_statistics(task_id, task_statistics)
+            statistics[task_id] = task_statistics
+
+    return statistics
+
+
+def get_cached_subtasks_statistics(task_id):
+    if SUBTASKS_STATISTICS_CACHE_TTL <= 0:
+        return None
+    with _subtasks_statistics_lock:
+        cached = _subtasks_statistics_cache.get(task_id)
+        if cached is None:
+            return None
+        expires_at, statistics = cached
+        if expires_at < time.monotonic():
+            del _subtasks_statistics_cache[task_id]
+            return None
+        return statistics
+
+
+def cache_subtasks_statistics(task_id, statistics):
+    if SUBTASKS_STATISTICS_CACHE_TTL <= 0:
+        return
+    with _subtasks_statistics_lock:
+        _subtasks_statistics_cache[task_id] = (
+            time.monotonic() + SUBTASKS_STATISTICS_CACHE_TTL,
+            statistics
+        )
+
+
+def invalidate_subtasks_statistics(task_id=None):
+    """Сброс кэша статистики подзадач для задачи или целиком."""
+    with _subtasks_statistics_lock:
+        if task_id is None:
+            _subtasks_statistics_cache.clear()
+        else:
+            _subtasks_statistics_cache.pop(task_id, None)
 
 
 def change_task_status(task_id):
     task = db.session.query(Task).filter(Task.id == task_id).first()
     task.sent_time = datetime.now().isoformat()
     task.status = TaskStatus.in_queue
+    task.lease_expires_at = get_lease_expiration()
     db.session.commit()
 
 
 def change_subtask_status(subtask):
     subtask.status = TaskStatus.in_queue
+    subtask.lease_expires_at = get_lease_expiration()
+    db.session.commit()
+
+
+def get_lease_expiration():
+    """Момент, после которого отправленная задача считается потерянной."""
+    return datetime.now() + timedelta(minutes=LEASE_TIMEOUT)
+
+
+def reclaim_expired_leases(limit):
+    """Возврат в retry задач и подзадач, аренда которых истекла.
+
+    Задача остаётся в in_queue навсегда, если сообщение потерялось или
+    воркер упал, не успев его взять. Такие строки находятся по частичным
+    индексам ix_tasks_lease и ix_subtasks_lease. Задачи in_progress не
+    возвращаются: воркер аренду не продлевает, и задача дольше
+    LEASE_TIMEOUT ушла бы повторно. Возвращает количество возвращённых
+    задач и подзадач.
+    """
+    now = datetime.now()
+    reclaimed = []
+    for model in (Task, Subtask):
+        expired_ids = db.session.query(model.id).filter(
+            model.status == TaskStatus.in_queue
+        ).filter(
+            model.lease_expires_at < now
+        ).limit(limit).with_for_update(skip_locked=True)
+
+        result = db.session.execute(
+            model.__table__.update().where(
+                model.id.in_(expired_ids)
+            ).values(
+                status=TaskStatus.retry,
+                lease_expires_at=None
+            )
+        )
+        reclaimed.append(result.rowcount)
+    db.session.commit()
+    return tuple(reclaimed)
+
+
+def claim_tasks(task_ids_query, limit):
+    """Захват пачки задач одним UPDATE ... RETURNING вместо SELECT и COMMIT на каждую.
+
+    Строки блокируются через FOR UPDATE SKIP LOCKED, поэтому несколько
+    продюсеров разбирают очередь без пересечений. Возвращает пары
+    (id задачи, приоритет).
+    """
+    locked_task_ids = task_ids_query.filter(
+        Task.status.is_(None) |
+        Task.status.notin_([TaskStatus.in_queue, TaskStatus.in_progress])
+    ).limit(limit).with_for_update(skip_locked=True, of=Task)
+
+    result = db.session.execute(
+        Task.__table__.update().where(
+            Task.id.in_(locked_task_ids)
+        ).values(
+            status=TaskStatus.in_queue,
+            sent_time=datetime.now(),
+            lease_expires_at=get_lease_expiration()
+        ).returning(Task.id, Task.priority)
+    )
+    claimed = [(row.id, get_task_priority(row.priority)) for row in result]
+    db.session.commit()
+    return claimed
+
+
+def get_task_priority(priority):
+    """Приоритет задачи; без приоритета или с неизвестным - DEFAULT_TASK_PRIORITY."""
+    return priority if priority in TASK_PRIORITIES else DEFAULT_TASK_PRIORITY
+
+
+def claim_keywords_ready_to_sent(limit, task_ids=None, quotas=None):
+    return claim_ready_to_sent(TaskKeyword, limit, task_ids, quotas)
+
+
+def claim_sources_ready_to_sent(limit, task_ids=None, quotas=None):
+    return claim_ready_to_sent(TaskSource, limit, task_ids, quotas)
+
+
+def claim_ready_to_sent(model, limit, task_ids=None, quotas=None):
+    ready = ready_to_sent_subquery(model, quotas, task_ids)
+    query = db.session.query(Task.id).join(
+        ready,
+        ready.c.task_id == Task.id
+    ).order_by(*ready_order(ready, quotas))
+    return claim_tasks(query, limit)
+
+
+def claim_subtasks(subtask_type, limit, subtask_ids=None):
+    """Захват пачки подзадач указанного типа одним UPDATE ... RETURNING.
+
+    Очередь обходится по ключу: каждый тик продолжает с id, на котором
+    остановился предыдущий, и только дойдя до конца начинает сверху. Так
+    индекс ix_subtasks_backlog не просматривается заново с начала на
+    каждом тике. Как и в claim_tasks, занятые другим продюсером строки
+    пропускаются.
+    """
+    if subtask_ids is not None:
+        return claim_subtasks_page(subtask_type, limit, subtask_ids=subtask_ids)
+
+    with _subtask_cursors_lock:
+        cursor = _subtask_cursors.get(subtask_type)
+    claimed_ids = claim_subtasks_page(subtask_type, limit, before_id=cursor)
+    last_page_ids = claimed_ids
+    if len(claimed_ids) < limit and cursor is not None:
+        # Конец очереди: продолжаем сверху
+        last_page_ids = claim_subtasks_page(subtask_type, limit - len(claimed_ids))
+        claimed_ids = claimed_ids + last_page_ids
+
+    with _subtask_cursors_lock:
+        if len(claimed_ids) == limit and last_page_ids:
+            _subtask_cursors[subtask_type] = min(last_page_ids)
+        else:
+            _subtask_cursors.pop(subtask_type, None)
+    return claimed_ids
+
+
+def claim_subtasks_page(subtask_type, limit, before_id=None, subtask_ids=None):
+    query = subtasks_query(subtask_type, before_id).with_entities(Subtask.id)
+    if subtask_ids is not None:
+        query = query.filter(Subtask.id.in_(subtask_ids))
+    locked_subtask_ids = query.limit(limit).with_for_update(skip_locked=True)
+
+    result = db.session.execute(
+        Subtask.__table__.update().where(
+            Subtask.id.in_(locked_subtask_ids)
+        ).values(
+            status=TaskStatus.in_queue,
+            lease_expires_at=get_lease_expiration()
+        ).returning(Subtask.id)
+    )
+    subtask_ids = [row.id for row in result]
     db.session.commit()
+    return subtask_ids
+
+
+def get_keywords_ready_to_sent(quotas=None, task_ids=None):
+    return ready_to_sent_query(TaskKeyword, quotas, task_ids)
+
+
+def get_sources_ready_to_sent(quotas=None, task_ids=None):
+    return ready_to_sent_query(TaskSource, quotas, task_ids)
 
 
-def get_keywords_ready_to_sent():
-    return db.session.query(TaskKeyword). \
-        join(Task, TaskKeyword.task_id == Task.id).filter(Task.id.in_(get_tasks_query()))
+def ready_to_sent_query(model, quotas=None, task_ids=None):
+    """Пары (task_id, priority) готовых задач по ключевым словам или источникам."""
+    ready = ready_to_sent_subquery(model, quotas, task_ids)
+    return db.session.query(
+        ready.c.task_id,
+        ready.c.priority
+    ).order_by(*ready_order(ready, quotas))
 
 
-def get_sources_ready_to_sent():
-    return db.session.query(TaskSource). \
-        join(Task, TaskSource.task_id == Task.id).filter(Task.id.in_(get_tasks_query()))
-        
+def ready_to_sent_subquery(model, quotas=None, task_ids=None):
+    """Готовые задачи по ключевым словам или источникам: task_id, priority, rank.
+
+    С quotas ({приоритет: квота}) задачи ещё и нумеруются внутри приоритета
+    в порядке очереди (number), а приоритеты без квоты отбрасываются.
+    """
+    ready_tasks = ready_tasks_subquery()
+    columns = [model.task_id.label('task_id'), ready_tasks.c.priority, ready_tasks.c.rank]
+    if quotas is not None:
+        columns.append(func.row_number().over(
+            partition_by=ready_tasks.c.priority,
+            order_by=ready_tasks.c.rank
+        ).label('number'))
+
+    query = db.session.query(*columns).join(
+        ready_tasks,
+        model.task_id == ready_tasks.c.id
+    )
+    if task_ids is not None:
+        query = query.filter(model.task_id.in_(task_ids))
+    if quotas is not None:
+        query = query.filter(ready_tasks.c.priority.in_(list(quotas)))
+    return query.subquery()
+
+
+def ready_order(ready, quotas=None):
+    """Порядок выборки из ready_to_sent_subquery.
+
+    С quotas первыми идут задачи в пределах квоты своего приоритета, следом
+    остальные: ими добираются квоты приоритетов, которым не хватило готовых
+    задач. Так все приоритеты выбираются одним запросом, а не запросом на
+    каждый.
+    """
+    if quotas is None:
+        return (ready.c.rank,)
+    quota = case(
+        [(ready.c.priority == priority, quota) for priority, quota in quotas.items()],
+        else_=0
+    )
+    return (ready.c.number > quota, ready.c.rank)
+
 
 def get_tasks_query():
+    """Идентификаторы задач, готовых к отправке, в порядке очереди."""
+    ready_tasks = ready_tasks_subquery()
+    return db.session.query(ready_tasks.c.id).order_by(ready_tasks.c.rank)
+
+
+def task_priority_condition(finished_before):
+    return (Task.priority == 1) | \
+        ((Task.priority.is_(None)) | (Task.priority.in_(DELAYED_PRIORITIES))) & \
+        ((Task.finish_time.is_(None)) | (Task.finish_time < finished_before))
+
+
+def ready_check_condition(check, param, now):
+    """Условие проверки уровня из TIER_CONDITIONS."""
+    if check == 'new':
+        return Task.status.is_(None)
+    if check == 'retry':
+        return and_(
+            Task.status == TaskStatus.retry,
+            or_(
+                Task.finish_time + param < now,
+                Task.finish_time.is_(None)
+            )
+        )
+    if check == 'interval_passed':
+        return task_interval_passed_condition(now)
+    return task_priority_condition(now - param)
+
+
+def ready_task_candidates_subquery():
+    """Все задачи, готовые к отправке, с уровнем каждой из них.
+
+    Уровни (READINESS_TIERS): 1 - новые, 2 - retry, 3 - повторная отправка
+    успешных, 4 - запасной вариант. Задача получает первый подходящий уровень.
+    """
     now = datetime.now()
-    two_days_ago = now - timedelta(days=2)
-
-    # Get count of new tasks with status NULL
-    #none_count = db.session.query(Task).filter(Task.status.is_(None)).count()
-    none_count = db.session.query(Task).filter(
-        Task.status.is_(None),
-        (Task.priority == 1) | 
-        ((Task.priority.is_(None)) | (Task.priority.in_([2, 3]))) & 
-        ((Task.finish_time.is_(None)) | (Task.finish_time < two_days_ago))
-    ).count()
-    print("New tasks with null count: {}".format(none_count))
-
-    if none_count > 0:
-        return db.session.query(Task.id).filter(
-            Task.status.is_(None),
-            (Task.priority == 1) | 
-            ((Task.priority.is_(None)) | (Task.priority.in_([2, 3]))) & 
-            ((Task.finish_time.is_(None)) | (Task.finish_time < two_days_ago))
-        ).order_by(Task.id)
-
-    # Get count of tasks in retry state
-    retry_new_task_count = db.session.query(Task).filter(
-        Task.status == TaskStatus.retry
+    conditions = [
+        (and_(*(ready_check_condition(check, param, now) for check, param in checks)), tier)
+        for tier, checks in TIER_CONDITIONS.items()
+    ]
+
+    tier = case(conditions)
+    return db.session.query(
+        Task.id.label('id'),
+        tier.label('tier'),
+        case(
+            [(Task.priority.in_(TASK_PRIORITIES), Task.priority)],
+            else_=DEFAULT_TASK_PRIORITY
+        ).label('priority'),
+        Task.received_time.label('received_time'),
+        Task.finish_time.label('finish_time')
     ).filter(
-        text(f"((tasks.finish_time + interval '3 minute') < '{now}' or tasks.finish_time is Null)")
-    ).count()
-
-    print("Retry new task with finish time count: {}".format(retry_new_task_count))
+        or_(*(condition for condition, _ in conditions))
+    ).subquery()
+
+
+def get_tasks_readiness_counts():
+    """Количество готовых к отправке задач по уровням: {уровень: количество}."""
+    candidates = ready_task_candidates_subquery()
+    counts = read_session.query(
+        candidates.c.tier,
+        func.count()
+    ).group_by(candidates.c.tier).all()
+    return {READINESS_TIERS[tier]: count for tier, count in counts}
+
+
+def ready_tasks_subquery():
+    """Ранжированный список готовых задач за один запрос.
+
+    Для каждого приоритета в выборку попадают только задачи лучшего из его
+    непустых уровней, как и при последовательной проверке уровней через
+    count(). Поэтому большой объём низкоприоритетных задач не задерживает
+    задачи приоритета 1, а в общем порядке они идут первыми.
+    """
+    candidates = ready_task_candidates_subquery()
+
+    # Порядок внутри уровня - поля TIER_ORDER, затем TIER_ORDER_TIEBREAK
+    order = [candidates.c.priority, candidates.c.tier]
+    for tier, columns in TIER_ORDER.items():
+        order.extend(case([(candidates.c.tier == tier, candidates.c[name])]) for name in columns)
+    order.extend(candidates.c[name] for name in TIER_ORDER_TIEBREAK)
+    ranked = db.session.query(
+        candidates.c.id,
+        candidates.c.tier,
+        candidates.c.priority,
+        func.min(candidates.c.tier).over(
+            partition_by=candidates.c.priority
+        ).label('best_tier'),
+        func.row_number().over(order_by=order).label('rank')
+    ).subquery()
+
+    return db.session.query(
+        ranked.c.id,
+        ranked.c.tier,
+        ranked.c.priority,
+        ranked.c.rank
+    ).filter(ranked.c.tier == ranked.c.best_tier).subquery()
 
-    if retry_new_task_count > 0:
-        return db.session.query(Task.id).filter(
-            Task.status == TaskStatus.retry
-        ).filter(
-            text(f"((tasks.finish_time + interval '3 minute') < '{now}' or tasks.finish_time is Null)")
-        ).order_by(Task.received_time)
-
-    # SUCCESS CONDITION (Repeat Send)
-    success_count = db.session.query(Task).filter(
-            text(
-                "(tasks.received_time is not Null) and "
-                "(tasks.finish_time + (tasks.interval || ' minute')::interval) < '" + str(now) + "'"
-                " and tasks.enabled = true"
-                " and (tasks.status = 'success')"
-            ),
-            (Task.priority == 1) | 
-            ((Task.priority.is_(None)) | (Task.priority.in_([2, 3]))) & 
-            ((Task.finish_time.is_(None)) | (Task.finish_time < two_days_ago))
-        ).count()
-    
-    print("Tasks with success status count: {}".format(success_count))
-
-    if success_count > 0:
-        return db.session.query(Task.id).filter(
-            text(
-                "(tasks.received_time is not Null) and "
-                "(tasks.finish_time + (tasks.interval || ' minute')::interval) < '" + str(now) + "'"
-                " and tasks.enabled = true"
-                " and (tasks.status = 'success')"
-            ),
-            (Task.priority == 1) | 
-            ((Task.priority.is_(None)) | (Task.priority.in_([2, 3]))) & 
-            ((Task.finish_time.is_(None)) | (Task.finish_time < two_days_ago))
-        ).order_by(Task.finish_time)
-
-    # FINAL FALLBACK: Get any remaining tasks
-    return db.session.query(Task.id).filter(
-        task_ready_to_send_condition_repeat_send(),
-        (Task.priority == 1) | 
-        ((Task.priority.is_(None)) | (Task.priority.in_([2, 3]))) & 
-        ((Task.finish_time.is_(None)) | (Task.finish_time < two_days_ago))
-    ).order_by(Task.finish_time)
 
 def get_like_ready_to_sent():
     return subtasks_query(SubtaskType.like)
@@ -271,27 +723,35 @@ def get_comments_to_sent():
     return subtasks_query(SubtaskType.comment)
 
 
-def subtasks_query(subtask_type):
-    return db.session.query(Subtask).filter(
-        Subtask.subtask_type == subtask_type
-    ).filter(
-        text('subtasks.status is Null or subtasks.status = \'retry\'')
-    ).order_by(Subtask.id.desc())
+def subtask_backlog_condition():
+    """Подзадачи, ожидающие отправки; совпадает с условием индекса ix_subtasks_backlog."""
+    return or_(Subtask.status.is_(None), Subtask.status == TaskStatus.retry)
 
 
-def task_ready_to_send_condition_repeat_send():
-    now = datetime.now()
-    two_days_ago = now - timedelta(days=1)
-
-    return text(
-        "(tasks.received_time is not Null) "
-        "AND (tasks.finish_time + (tasks.interval || ' minute')::interval) < '" + str(now) + "' "
-        "AND tasks.enabled = true "
-        "AND tasks.status = 'success' "
-        "AND (tasks.priority = 1 OR "
-        "(tasks.priority IS NULL OR tasks.priority IN (2, 3)) "
-        "AND (tasks.finish_time IS NULL OR tasks.finish_time < '" + str(two_days_ago) + "'))"
+def subtasks_query(subtask_type, before_id=None):
+    query = db.session.query(Subtask).filter(
+        Subtask.subtask_type == subtask_type
+    ).filter(
+        subtask_backlog_condition()
     )
+    if before_id is not None:
+        query = query.filter(Subtask.id < before_id)
+    return query.order_by(Subtask.id.desc())
+
+
+def task_interval_passed_condition(now):
+    """Успешная включённая задача, интервал повторной отправки которой прошёл.
+
+    Время передаётся bind-параметром, поэтому текст запроса не меняется
+    от тика к тику.
+    """
+    return and_(
+        Task.received_time.isnot(None),
+        Task.finish_time + Task.interval * MINUTE < now,
+        Task.enabled == true(),
+        Task.status == TaskStatus.success
+    )
+
 
 def get_available_wc():
     available_wc_count = db.session.query(WorkerCredential).filter(
@@ -299,12 +759,13 @@ def get_available_wc():
     ).filter(
         WorkerCredential.inProgress == false()
     ).filter(
-        text('((worker_credentials.last_time_finished + \'' +
-             str(TIMEOUT_BETWEEN_ACCOUNTS_WORK) +
-             ' minute\'::interval) < \'' + str(datetime.now()) +
-             "\' or worker_credentials.last_time_finished is Null)")
+        or_(
+            WorkerCredential.last_time_finished +
+            timedelta(minutes=TIMEOUT_BETWEEN_ACCOUNTS_WORK) < datetime.now(),
+            WorkerCredential.last_time_finished.is_(None)
+        )
     ).count()
 
-    logger.log("Available wc count to send: {}".format(str(available_wc_count)))
+    logger.debug("Available wc count to send", count=available_wc_count)
 
     return available_wc_count
@@ -1,8 +1,8 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from sqlalchemy import false, func, text, true
+from sqlalchemy import false, func, or_, true
 
-from ..database import db
+from ..database import db, read_session
 from ..database.models import (FBAccount, Proxy, UserAgent, WindowSize,
                                WorkerCredential)
 from ..main import logger
@@ -29,8 +29,8 @@ def get_accounts():
 
 def get_accounts_stat():
     """Получение статистики по аккаунтам."""
-    all = db.session.query(FBAccount).count()
-    available = db.session.query(FBAccount).filter(FBAccount.available == true()).count()
+    all = read_session.query(FBAccount).count()
+    available = read_session.query(FBAccount).filter(FBAccount.available == true()).count()
     return all, available
 
 
@@ -103,13 +103,13 @@ def free_frozen_credentials():
     credentials = db.session.query(WorkerCredential).filter(
         WorkerCredential.inProgress == true()
     ).filter(
-        text(
-            '(worker_credentials.alive_timestamp is not Null) and (worker_credentials.alive_timestamp + \'5 minute\'::interval) < \'' +
-            str(datetime.now()) + "\'")
+        WorkerCredential.alive_timestamp.isnot(None)
+    ).filter(
+        WorkerCredential.alive_timestamp + timedelta(minutes=5) < datetime.now()
     ).with_for_update().all()
 
     for c in credentials:
-        print("working_credentials with id={} set inProgress=false".format(c.id))
+        logger.item("free_frozen_credential", "working_credentials set inProgress=false", id=c.id)
         c.inProgress = False
         db.session.commit()
 
@@ -124,8 +124,10 @@ def get_disabled_proxies(limit):
     ).filter(
         Proxy.available == false()
     ).filter(
-        text('((proxy.last_time_checked + \'20 minute\'::interval) < \'' +
-             str(datetime.now()) + "\' or proxy.last_time_checked is Null)")
+        or_(
+            Proxy.last_time_checked + timedelta(minutes=20) < datetime.now(),
+            Proxy.last_time_checked.is_(None)
+        )
     )
     if limit:
         return query.limit(limit).all()
@@ -0,0 +1,53 @@
+"""Массовая загрузка задач: python -m app.ingest keywords tasks.jsonl
+
+Файл (или - для stdin) в формате JSON Lines: по объекту на строку с теми же
+полями, что у create_keyword и create_source - keyword или source_id,
+interval, retro, enabled и необязательный until. Уникальные индексы, по
+которым пропускаются дубли, создаёт обновление схемы планировщика; без них
+загрузка не начинается.
+"""
+import argparse
+import json
+import sys
+
+from .database.schema import get_unusable_indexes
+from .database.tasks_dao import bulk_create_keywords, bulk_create_sources
+from .main import app, logger
+
+LOADERS = {
+    'keywords': bulk_create_keywords,
+    'sources': bulk_create_sources,
+}
+# Уникальные индексы, на которые опирается ON CONFLICT загрузки
+UNIQUE_INDEXES = {
+    'keywords': 'ux_tasks_keyword_keyword',
+    'sources': 'ux_tasks_source_source_id',
+}
+
+
+def read_rows(stream):
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('type', choices=sorted(LOADERS))
+    parser.add_argument('file', help='JSON Lines или - для stdin')
+    args = parser.parse_args()
+
+    stream = sys.stdin if args.file == '-' else open(args.file)
+    with stream, app.app_context():
+        if get_unusable_indexes([UNIQUE_INDEXES[args.type]]):
+            sys.exit(
+                "Unique index {0} is missing or invalid: apply the scheduler schema upgrades; "
+                "if the index is invalid, remove duplicates, DROP INDEX {0} and apply them "
+                "again".format(UNIQUE_INDEXES[args.type])
+            )
+        counts = LOADERS[args.type](read_rows(stream))
+    logger.info("bulk ingestion", type=args.type, **counts)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 import os
 
 from flask import Flask
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
 
 from .utils.logging import Log
 
@@ -10,15 +12,158 @@ logger = Log()
 CURRENT_PROFILE = 'prod'
 
 app.config['CELERY_QUEUE_NAME'] = 'tasks'
-app.config['CELERY_BROKER_URL'] = 'amqp://guest@{0}//'.format(
+app.config['CELERY_BROKER_URL'] = os.environ.get('CELERY_BROKER_URL') or 'amqp://guest@{0}//'.format(
     os.environ.get('RABBITMQ_SERVICE_SERVICE_HOST')
 )
-app.config['CELERY_BACKEND'] = 'amqp'
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('FBS_DATABASE_POSTGRESQL_SERVICE_HOST')
 
-logger.log("PRODUCER LINK " + app.config['SQLALCHEMY_DATABASE_URI'])
+# Хранилище результатов задач: 'ignore' - результаты не отслеживаются
+# (fire-and-forget), 'database' - таблицы celery в основной БД,
+# иначе - URL backend'а, например redis://host:6379/0.
+# Воркеры celery должны быть запущены с тем же backend'ом, иначе результаты
+# пишутся туда, где producer их не ищет. Режим 'database' добавляет запись
+# результата на каждую задачу в основную (OLTP) БД, поэтому по умолчанию
+# результаты не отслеживаются.
+app.config['CELERY_RESULT_MODE'] = os.environ.get('CELERY_RESULT_MODE', 'ignore')
+if app.config['CELERY_RESULT_MODE'] == 'ignore':
+    app.config['CELERY_BACKEND'] = None
+elif app.config['CELERY_RESULT_MODE'] == 'database':
+    if not app.config['SQLALCHEMY_DATABASE_URI']:
+        raise RuntimeError(
+            "CELERY_RESULT_MODE=database requires FBS_DATABASE_POSTGRESQL_SERVICE_HOST to be set"
+        )
+    app.config['CELERY_BACKEND'] = 'db+' + app.config['SQLALCHEMY_DATABASE_URI']
+else:
+    app.config['CELERY_BACKEND'] = app.config['CELERY_RESULT_MODE']
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Пул соединений с БД на процесс: размер, переполнение, ожидание свободного
+# соединения (сек.), проверка соединения перед выдачей и пересоздание
+# соединений старше DATABASE_POOL_RECYCLE секунд
+app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+app.config['DATABASE_MAX_OVERFLOW'] = int(os.environ.get('DATABASE_MAX_OVERFLOW', 5))
+app.config['DATABASE_POOL_TIMEOUT'] = int(os.environ.get('DATABASE_POOL_TIMEOUT', 10))
+app.config['DATABASE_POOL_PRE_PING'] = os.environ.get('DATABASE_POOL_PRE_PING', 'true').lower() == 'true'
+app.config['DATABASE_POOL_RECYCLE'] = int(os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+# Подключение через PgBouncer в режиме transaction: пулом управляет PgBouncer,
+# LISTEN/NOTIFY недоступен
+app.config['DATABASE_PGBOUNCER_MODE'] = os.environ.get('DATABASE_PGBOUNCER_MODE', 'false').lower() == 'true'
+if app.config['DATABASE_PGBOUNCER_MODE']:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': NullPool}
+else:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': app.config['DATABASE_POOL_SIZE'],
+        'max_overflow': app.config['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DATABASE_POOL_TIMEOUT'],
+        'pool_pre_ping': app.config['DATABASE_POOL_PRE_PING'],
+        'pool_recycle': app.config['DATABASE_POOL_RECYCLE'],
+    }
+
+# Реплики для тяжёлых чтений: URI через запятую, допустимое отставание реплики
+# (сек.), сверх которого чтения идут в основную БД, и период его проверки (сек.)
+app.config['DATABASE_REPLICA_URIS'] = [
+    uri.strip() for uri in os.environ.get('DATABASE_REPLICA_URIS', '').split(',') if uri.strip()
+]
+app.config['DATABASE_REPLICA_MAX_LAG'] = float(os.environ.get('DATABASE_REPLICA_MAX_LAG', 30))
+app.config['DATABASE_REPLICA_CHECK_INTERVAL'] = float(os.environ.get('DATABASE_REPLICA_CHECK_INTERVAL', 5))
+
+# Добавление недостающих столбцов и индексов (schema.SCHEMA_UPGRADES) при старте
+app.config['SCHEMA_UPGRADES_ENABLED'] = os.environ.get('SCHEMA_UPGRADES_ENABLED', 'true').lower() == 'true'
+
+# Захват задач пачкой (UPDATE ... RETURNING) вместо SELECT и COMMIT на каждую
+app.config['DISPATCH_BATCH_MODE'] = os.environ.get('DISPATCH_BATCH_MODE', 'false').lower() == 'true'
+
+# Несколько захваченных id одного типа в одном сообщении (задачи *_ids, только
+# вместе с DISPATCH_BATCH_MODE): максимум id в сообщении и сериализатор
+app.config['DISPATCH_BATCH_MESSAGES'] = os.environ.get('DISPATCH_BATCH_MESSAGES', 'false').lower() == 'true'
+app.config['DISPATCH_BATCH_MESSAGE_SIZE'] = int(os.environ.get('DISPATCH_BATCH_MESSAGE_SIZE', 50))
+app.config['DISPATCH_BATCH_MESSAGE_SERIALIZER'] = os.environ.get('DISPATCH_BATCH_MESSAGE_SERIALIZER', 'msgpack')
+
+# Пакетная публикация в брокер: размер пачки, интервал сброса буфера (сек.),
+# ожидание подтверждений брокера (сек.) и размер пула соединений
+app.config['PUBLISHER_FLUSH_SIZE'] = int(os.environ.get('PUBLISHER_FLUSH_SIZE', 100))
+app.config['PUBLISHER_FLUSH_INTERVAL'] = float(os.environ.get('PUBLISHER_FLUSH_INTERVAL', 1.0))
+app.config['PUBLISHER_CONFIRM_TIMEOUT'] = float(os.environ.get('PUBLISHER_CONFIRM_TIMEOUT', 5.0))
+app.config['PUBLISHER_POOL_LIMIT'] = int(os.environ.get('PUBLISHER_POOL_LIMIT', 10))
+
+# Немедленная отправка по LISTEN/NOTIFY в дополнение к периодической проверке
+app.config['DISPATCH_EVENT_MODE'] = os.environ.get('DISPATCH_EVENT_MODE', 'false').lower() == 'true'
+app.config['DISPATCH_EVENT_DEBOUNCE'] = float(os.environ.get('DISPATCH_EVENT_DEBOUNCE', 0.5))
+
+# Регулирование объёма отправки по глубине очередей брокера (AIMD)
+app.config['BACKPRESSURE_ENABLED'] = os.environ.get('BACKPRESSURE_ENABLED', 'false').lower() == 'true'
+app.config['BACKPRESSURE_TARGET_DEPTH'] = int(os.environ.get('BACKPRESSURE_TARGET_DEPTH', 100))
+app.config['BACKPRESSURE_MIN_LIMIT'] = int(os.environ.get('BACKPRESSURE_MIN_LIMIT', 1))
+app.config['BACKPRESSURE_MAX_LIMIT'] = int(os.environ.get('BACKPRESSURE_MAX_LIMIT', 1000))
+app.config['BACKPRESSURE_ADDITIVE_STEP'] = int(os.environ.get('BACKPRESSURE_ADDITIVE_STEP', 10))
+app.config['BACKPRESSURE_DECREASE_FACTOR'] = float(os.environ.get('BACKPRESSURE_DECREASE_FACTOR', 0.5))
+app.config['BACKPRESSURE_EWMA_ALPHA'] = float(os.environ.get('BACKPRESSURE_EWMA_ALPHA', 0.3))
+
+# Веса типов задач при распределении свободных рабочих аккаунтов (0 - тип не отправляется)
+app.config['DISPATCH_WEIGHTS'] = {
+    'keyword': float(os.environ.get('DISPATCH_WEIGHT_KEYWORD', 1)),
+    'source': float(os.environ.get('DISPATCH_WEIGHT_SOURCE', 1)),
+    'like': float(os.environ.get('DISPATCH_WEIGHT_LIKE', 0)),
+    'comment': float(os.environ.get('DISPATCH_WEIGHT_COMMENT', 0)),
+    'share': float(os.environ.get('DISPATCH_WEIGHT_SHARE', 0)),
+    'personal_page': float(os.environ.get('DISPATCH_WEIGHT_PERSONAL_PAGE', 0)),
+}
+
+# Веса приоритетов задач внутри доли keyword и source (1 - наивысший приоритет)
+app.config['DISPATCH_PRIORITY_WEIGHTS'] = {
+    1: float(os.environ.get('DISPATCH_PRIORITY_WEIGHT_1', 6)),
+    2: float(os.environ.get('DISPATCH_PRIORITY_WEIGHT_2', 3)),
+    3: float(os.environ.get('DISPATCH_PRIORITY_WEIGHT_3', 1)),
+}
+# Приоритет сообщений в брокере; очереди объявляются с x-max-priority, воркеры
+# должны объявлять их так же
+app.config['BROKER_PRIORITY_ENABLED'] = os.environ.get('BROKER_PRIORITY_ENABLED', 'false').lower() == 'true'
+
+# Ограничение скорости отправки по типам, сообщений в секунду (0 - без ограничения)
+app.config['DISPATCH_RATE_CAPS'] = {
+    'keyword': float(os.environ.get('DISPATCH_RATE_CAP_KEYWORD', 0)),
+    'source': float(os.environ.get('DISPATCH_RATE_CAP_SOURCE', 0)),
+    'like': float(os.environ.get('DISPATCH_RATE_CAP_LIKE', 0)),
+    'comment': float(os.environ.get('DISPATCH_RATE_CAP_COMMENT', 0)),
+    'share': float(os.environ.get('DISPATCH_RATE_CAP_SHARE', 0)),
+    'personal_page': float(os.environ.get('DISPATCH_RATE_CAP_PERSONAL_PAGE', 0)),
+}
+
+# Распределение сообщений тика по интервалу: off, wheel (колесо времени в
+# продюсере) или countdown (задержка на воркере); число ячеек колеса за интервал
+app.config['DISPATCH_SPREAD_MODE'] = os.environ.get('DISPATCH_SPREAD_MODE', 'off').lower()
+app.config['DISPATCH_SPREAD_SLOTS'] = int(os.environ.get('DISPATCH_SPREAD_SLOTS', 30))
+
+# Минимальное число свободных рабочих аккаунтов, при котором идёт отправка
+app.config['MIN_AVAILABLE_WC'] = int(os.environ.get('MIN_AVAILABLE_WC', 4))
+
+# Период периодической проверки и отправки задач (check_tasks), сек.
+CHECK_TASKS_INTERVAL = 30
+
 TIMEOUT_BETWEEN_ACCOUNTS_WORK = 3
 TIMEOUT_BETWEEN_RETRY_SEND = 5
+
+# Аренда отправленной задачи в минутах: по истечении задача, которую ещё не
+# взял воркер (in_queue), возвращается в retry
+LEASE_TIMEOUT = int(os.environ.get('LEASE_TIMEOUT', 120))
+
+# Время жизни кэша статистики подзадач в секундах, 0 - кэш отключён
+SUBTASKS_STATISTICS_CACHE_TTL = int(os.environ.get('SUBTASKS_STATISTICS_CACHE_TTL', 0))
+
+# Порт HTTP-сервера метрик процесса планировщика, 0 - не запускать
+SCHEDULER_METRICS_PORT = int(os.environ.get('SCHEDULER_METRICS_PORT', 9100))
+
+
+def create_app():
+    """Приложение API без запуска планировщика.
+
+    Метрики отдаёт процесс планировщика на SCHEDULER_METRICS_PORT.
+    """
+    logger.info("PRODUCER LINK", database=get_database_link())
+    return app
+
+
+def get_database_link():
+    """Адрес БД для лога, без пароля."""
+    return repr(make_url(app.config['SQLALCHEMY_DATABASE_URI']))
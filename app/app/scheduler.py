@@ -0,0 +1,16 @@
+"""Процесс планировщика: python -m app.scheduler"""
+from .main import SCHEDULER_METRICS_PORT, get_database_link, logger
+from .services.metrics_service import init_metrics, start_metrics_server
+from .services.scheduler_service import run_scheduler
+
+
+def main():
+    init_metrics(readiness=True)
+    if SCHEDULER_METRICS_PORT:
+        start_metrics_server(SCHEDULER_METRICS_PORT)
+    logger.info("PRODUCER SCHEDULER", database=get_database_link())
+    run_scheduler(block=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +0,0 @@
-from . import scheduler_service
-from . import credentials_management
@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+class BackpressureController:
+    """AIMD-регулятор количества сообщений, отправляемых за один тик.
+
+    На вход получает глубину очередей брокера после каждого тика. По разнице
+    глубины с учётом отправленного оценивает скорость разбора очереди
+    потребителями (EWMA, сообщений в секунду). Пока очередь не выше целевой
+    глубины, лимит растёт на additive_step, иначе умножается на
+    decrease_factor. Итоговая квота не больше лимита и не больше того, что
+    потребители успеют разобрать до следующего тика сверх целевой глубины.
+    """
+
+    def __init__(self, target_depth=100, initial_limit=50, min_limit=1,
+                 max_limit=1000, additive_step=10, decrease_factor=0.5,
+                 ewma_alpha=0.3, tick_interval=30, clock=time.monotonic):
+        self.target_depth = target_depth
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.additive_step = additive_step
+        self.decrease_factor = decrease_factor
+        self.ewma_alpha = ewma_alpha
+        self.tick_interval = tick_interval
+        self.clock = clock
+
+        self.limit = initial_limit
+        self.completion_rate = None
+        self.last_depth = None
+        self.last_time = None
+        self.last_dispatched = 0
+        # update вызывает check_tasks, dispatched - ещё и слушатель NOTIFY
+        self.lock = threading.Lock()
+
+    def update(self, depth):
+        """Учёт текущей глубины очередей; возвращает квоту на этот тик."""
+        with self.lock:
+            now = self.clock()
+            if self.last_depth is not None and now > self.last_time:
+                consumed = max(self.last_depth + self.last_dispatched - depth, 0)
+                rate = consumed / (now - self.last_time)
+                if self.completion_rate is None:
+                    self.completion_rate = rate
+                else:
+                    self.completion_rate = self.ewma_alpha * rate + \
+                        (1 - self.ewma_alpha) * self.completion_rate
+
+            if depth > self.target_depth:
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+            else:
+                self.limit = min(self.max_limit, self.limit + self.additive_step)
+
+            self.last_depth = depth
+            self.last_time = now
+            self.last_dispatched = 0
+
+            headroom = max(self.target_depth - depth, 0) + \
+                (self.completion_rate or 0) * self.tick_interval
+            return int(min(self.limit, headroom))
+
+    def dispatched(self, count):
+        """Учёт количества сообщений, отправленных после последнего update."""
+        with self.lock:
+            self.last_dispatched += count
@@ -1,8 +1,19 @@
+import functools
+import threading
+
 from celery import Celery
 
 from ..database.models import SubtaskType
-from ..database.tasks_dao import change_subtask_status, change_task_status
-from ..main import app, logger
+from ..database.tasks_dao import (DEFAULT_TASK_PRIORITY, TASK_PRIORITIES,
+                                  change_subtask_status, change_task_status,
+                                  claim_keywords_ready_to_sent,
+                                  claim_sources_ready_to_sent, claim_subtasks,
+                                  get_keywords_ready_to_sent,
+                                  get_sources_ready_to_sent, subtasks_query)
+from ..main import CHECK_TASKS_INTERVAL, app, logger
+from ..utils.metrics import DISPATCHED, PUBLISH_DURATION, PUBLISHED
+from .publisher import Publisher
+from .spread import DispatchSpreader
 
 TASK_KEYWORD_ID = "task_keyword_id"
 TASK_SOURCE_ID = "task_source_id"
@@ -14,6 +25,52 @@ SUB_TASK_POST_COMMENTS = "sub_task_post_comments"
 SUB_TASK_POST_SHARES = "sub_task_post_shares"
 SUB_TASK_PERSONAL_PAGE = "sub_task_personal_page"
 
+# Пакетные сообщения (DISPATCH_BATCH_MESSAGES). Единственный аргумент - список
+# id одного типа длиной не больше DISPATCH_BATCH_MESSAGE_SIZE, сериализация -
+# DISPATCH_BATCH_MESSAGE_SERIALIZER. Контракт для воркеров:
+# - задачи *_ids регистрируются рядом с одиночными, сериализатор должен быть
+#   в accept_content воркера;
+# - все id уже захвачены (in_queue с арендой lease_expires_at), статус
+#   каждого меняется так же, как при обработке одиночного сообщения;
+# - ошибка одного id переводит в retry только его, сообщение целиком не
+#   повторяется;
+# - id, до которых воркер не дошёл, вернёт в очередь reclaim_expired после
+#   истечения аренды, поэтому пачка должна успевать обработаться за
+#   LEASE_TIMEOUT.
+TASK_KEYWORD_IDS = "task_keyword_ids"
+TASK_SOURCE_IDS = "task_source_ids"
+SUB_TASK_POST_LIKES_IDS = "sub_task_post_likes_ids"
+SUB_TASK_POST_COMMENTS_IDS = "sub_task_post_comments_ids"
+SUB_TASK_POST_SHARES_IDS = "sub_task_post_shares_ids"
+SUB_TASK_PERSONAL_PAGE_IDS = "sub_task_personal_page_ids"
+
+DISPATCHED_TASKS = (
+    TASK_KEYWORD_ID,
+    TASK_SOURCE_ID,
+    SUB_TASK_POST_LIKES,
+    SUB_TASK_POST_COMMENTS,
+    SUB_TASK_POST_SHARES,
+    SUB_TASK_PERSONAL_PAGE,
+    TASK_KEYWORD_IDS,
+    TASK_SOURCE_IDS,
+    SUB_TASK_POST_LIKES_IDS,
+    SUB_TASK_POST_COMMENTS_IDS,
+    SUB_TASK_POST_SHARES_IDS,
+    SUB_TASK_PERSONAL_PAGE_IDS,
+)
+
+
+def get_broker_priority(priority):
+    """Приоритет сообщения в брокере: у брокера больше - важнее, у задач наоборот."""
+    return len(TASK_PRIORITIES) - TASK_PRIORITIES.index(priority)
+
+
+def get_message_options(priority):
+    if priority is None or not app.config['BROKER_PRIORITY_ENABLED']:
+        return {}
+    return {'priority': get_broker_priority(priority)}
+
+
 celery = Celery(
     app.config['CELERY_QUEUE_NAME'],
     broker=app.config['CELERY_BROKER_URL'],
@@ -22,6 +79,60 @@ celery = Celery(
 celery.conf.update(app.config)
 celery.conf.task_routes = (
     [('task.*', {'queue': 'tasks'}), ('sub_task.*', {'queue': 'sub_tasks'})],)
+celery.conf.broker_pool_limit = app.config['PUBLISHER_POOL_LIMIT']
+celery.conf.task_ignore_result = app.config['CELERY_BACKEND'] is None
+if app.config['BROKER_PRIORITY_ENABLED']:
+    celery.conf.task_queue_max_priority = len(TASK_PRIORITIES)
+    celery.conf.task_default_priority = get_broker_priority(DEFAULT_TASK_PRIORITY)
+
+
+def observe_flush(count, latency):
+    PUBLISHED.inc(count)
+    PUBLISH_DURATION.observe(latency)
+
+
+publisher = Publisher(
+    celery,
+    flush_size=app.config['PUBLISHER_FLUSH_SIZE'],
+    flush_interval=app.config['PUBLISHER_FLUSH_INTERVAL'],
+    confirm_timeout=app.config['PUBLISHER_CONFIRM_TIMEOUT'],
+    ignore_result=app.config['CELERY_BACKEND'] is None,
+    on_flush=observe_flush
+)
+
+# Сообщения отправки задач и подзадач; с DISPATCH_SPREAD_MODE они копятся до
+# flush_published и расходятся по интервалу тика
+dispatch_publisher = publisher
+if app.config['DISPATCH_SPREAD_MODE'] in ('wheel', 'countdown'):
+    dispatch_publisher = DispatchSpreader(
+        publisher,
+        app.config['DISPATCH_SPREAD_MODE'],
+        interval=CHECK_TASKS_INTERVAL,
+        slots=app.config['DISPATCH_SPREAD_SLOTS']
+    )
+
+# Счётчик publish_dispatch для take_published_messages, свой у каждого потока
+published_messages = threading.local()
+
+
+def get_queue_depth():
+    """Количество сообщений в очередях брокера, куда уходят задачи и подзадачи.
+
+    Очереди берутся из маршрутизации celery, глубина - из пассивного
+    queue_declare, поэтому management API брокера не нужен.
+    """
+    queues = {celery.amqp.router.route({}, name)['queue'].name for name in DISPATCHED_TASKS}
+    depth = 0
+    with celery.connection_for_read() as connection:
+        for queue in queues:
+            channel = connection.channel()
+            try:
+                depth += channel.queue_declare(queue=queue, passive=True).message_count
+            except connection.channel_errors:
+                pass
+            finally:
+                channel.close()
+    return depth
 
 
 def send(task_limit, get_function, send_function):
@@ -36,18 +147,187 @@ def send(task_limit, get_function, send_function):
     return 0
 
 
-def send_keyword(task_id):
+def send_batch(task_limit, claim_function, publish_function, publish_ids_function=None):
+    """Пакетная отправка: захват пачки одной транзакцией, затем публикация."""
+    if task_limit > 0:
+        claimed_ids = claim_function(task_limit)
+        publish_claimed(claimed_ids, publish_function, publish_ids_function)
+        return len(claimed_ids)
+    return 0
+
+
+def publish_claimed(claimed_ids, publish_function, publish_ids_function=None):
+    """Публикация захваченных id.
+
+    С DISPATCH_BATCH_MESSAGES id публикуются через publish_ids_function
+    сообщениями по DISPATCH_BATCH_MESSAGE_SIZE id.
+    """
+    if publish_ids_function is not None and app.config['DISPATCH_BATCH_MESSAGES']:
+        size = app.config['DISPATCH_BATCH_MESSAGE_SIZE']
+        for start in range(0, len(claimed_ids), size):
+            publish_ids_function(claimed_ids[start:start + size])
+    else:
+        for claimed_id in claimed_ids:
+            publish_function(claimed_id)
+
+
+def send_tasks(task_limit, get_function, send_function):
+    """send для задач: строки (task_id, priority), результат - {приоритет: отправлено}."""
+    sent = {}
+    if task_limit > 0:
+        for task_id, priority in get_function().limit(task_limit).all():
+            send_function(task_id, priority)
+            sent[priority] = sent.get(priority, 0) + 1
+    return sent
+
+
+def send_tasks_batch(task_limit, claim_function, publish_function, publish_ids_function):
+    """send_batch для задач: один захват на все приоритеты, публикация по приоритетам.
+
+    claim_function возвращает пары (id задачи, приоритет), результат -
+    {приоритет: отправлено}.
+    """
+    claimed_by_priority = {}
+    if task_limit > 0:
+        for task_id, priority in claim_function(task_limit):
+            claimed_by_priority.setdefault(priority, []).append(task_id)
+
+    for priority, task_ids in claimed_by_priority.items():
+        publish_claimed(
+            task_ids,
+            functools.partial(publish_function, priority=priority),
+            functools.partial(publish_ids_function, priority=priority)
+        )
+    return {priority: len(task_ids) for priority, task_ids in claimed_by_priority.items()}
+
+
+def publish_ids(name, ids, **options):
+    """Публикация списка id одним сообщением (контракт - у TASK_KEYWORD_IDS)."""
+    publish_dispatch(
+        name,
+        args=(list(ids),),
+        serializer=app.config['DISPATCH_BATCH_MESSAGE_SERIALIZER'],
+        **options
+    )
+
+
+def publish_dispatch(name, args, **options):
+    """Публикация сообщения отправки задачи или подзадачи с учётом в потоке."""
+    published_messages.count = getattr(published_messages, 'count', 0) + 1
+    dispatch_publisher.publish(name, args=args, **options)
+
+
+def take_published_messages():
+    """Количество сообщений отправки, опубликованных потоком с прошлого вызова.
+
+    Глубина очереди считается в сообщениях, а не в id, поэтому backpressure
+    получает именно это число.
+    """
+    count = getattr(published_messages, 'count', 0)
+    published_messages.count = 0
+    return count
+
+
+def flush_published(spread_window=0):
+    """Отправка накопленных в буфере сообщений.
+
+    С DISPATCH_SPREAD_MODE сообщения отправки задач раскладываются на
+    spread_window секунд (0 - отправляются сразу).
+    """
+    if dispatch_publisher is not publisher:
+        dispatch_publisher.release(spread_window)
+    count = publisher.flush()
+    if count:
+        logger.debug(
+            "published messages",
+            count=count,
+            latency=round(publisher.last_flush_latency, 3),
+            unconfirmed_total=publisher.unconfirmed_count
+        )
+    return count
+
+
+def stop_spreader():
+    """Отправка сообщений, ещё ждущих в колесе времени, перед остановкой."""
+    if dispatch_publisher is not publisher:
+        dispatch_publisher.stop()
+        publisher.flush()
+
+
+def send_keywords(task_limit, quotas=None):
+    """Отправление готовых задач по ключевым словам в пределах квот приоритетов."""
+    if app.config['DISPATCH_BATCH_MODE']:
+        return send_tasks_batch(
+            task_limit,
+            lambda limit: claim_keywords_ready_to_sent(limit, quotas=quotas),
+            publish_keyword,
+            publish_keywords
+        )
+    return send_tasks(task_limit, lambda: get_keywords_ready_to_sent(quotas), send_keyword)
+
+
+def send_sources(task_limit, quotas=None):
+    """Отправление готовых задач по источникам в пределах квот приоритетов."""
+    if app.config['DISPATCH_BATCH_MODE']:
+        return send_tasks_batch(
+            task_limit,
+            lambda limit: claim_sources_ready_to_sent(limit, quotas=quotas),
+            publish_source,
+            publish_sources
+        )
+    return send_tasks(task_limit, lambda: get_sources_ready_to_sent(quotas), send_source)
+
+
+def send_subtasks(task_limit, subtask_type):
+    """Отправление готовых подзадач указанного типа."""
+    if app.config['DISPATCH_BATCH_MODE']:
+        return send_batch(
+            task_limit,
+            lambda limit: claim_subtasks(subtask_type, limit),
+            SUBTASK_SENDERS[subtask_type],
+            lambda subtask_ids: publish_subtasks(subtask_type, subtask_ids)
+        )
+    return send(task_limit, lambda: subtasks_query(subtask_type), send_subtask)
+
+
+def send_keyword(task_id, priority=None):
     """Отправление задачи по ключевому слову."""
-    logger.log("send keyword with task_id: {}".format(task_id))
     change_task_status(task_id)
-    celery.send_task(TASK_KEYWORD_ID, args=(task_id,))
+    publish_keyword(task_id, priority)
+
 
+def publish_keyword(task_id, priority=None):
+    """Публикация задачи по ключевому слову, статус которой уже изменён."""
+    logger.item("send_keyword", "send keyword", task_id=task_id, priority=priority)
+    DISPATCHED.labels('keyword').inc()
+    publish_dispatch(TASK_KEYWORD_ID, args=(task_id,), **get_message_options(priority))
 
-def send_source(task_id):
+
+def publish_keywords(task_ids, priority=None):
+    """Публикация захваченных задач по ключевым словам одним сообщением."""
+    logger.item("send_keywords", "send keywords", count=len(task_ids), priority=priority)
+    DISPATCHED.labels('keyword').inc(len(task_ids))
+    publish_ids(TASK_KEYWORD_IDS, task_ids, **get_message_options(priority))
+
+
+def send_source(task_id, priority=None):
     """Отправление задачи по указанному источнику."""
-    logger.log("send source with task_id: {}".format(task_id))
     change_task_status(task_id)
-    celery.send_task(TASK_SOURCE_ID, args=(task_id,))
+    publish_source(task_id, priority)
+
+
+def publish_source(task_id, priority=None):
+    """Публикация задачи по источнику, статус которой уже изменён."""
+    logger.item("send_source", "send source", task_id=task_id, priority=priority)
+    DISPATCHED.labels('source').inc()
+    publish_dispatch(TASK_SOURCE_ID, args=(task_id,), **get_message_options(priority))
+
+
+def publish_sources(task_ids, priority=None):
+    """Публикация захваченных задач по источникам одним сообщением."""
+    logger.item("send_sources", "send sources", count=len(task_ids), priority=priority)
+    DISPATCHED.labels('source').inc(len(task_ids))
+    publish_ids(TASK_SOURCE_IDS, task_ids, **get_message_options(priority))
 
 
 def send_keyword_by_task(task):
@@ -62,58 +342,75 @@ def send_source_by_task(task):
 
 def send_accounts_warming():
     """Отправление задачи по прогреву аккаунтов."""
-    logger.log("send account warming")
-    celery.send_task(TASK_WARM_ACCOUNT)
+    logger.item("send_account_warming", "send account warming")
+    publisher.publish(TASK_WARM_ACCOUNT)
 
 
 def send_re_login_disabled_accounts():
     """Отправление аккаунтов на перезапуск."""
-    logger.log("send re login disabled accounts")
-    celery.send_task(TASK_RE_LOGIN_ALL_DISABLED_ACCOUNTS)
+    logger.info("send re login disabled accounts")
+    publisher.publish(TASK_RE_LOGIN_ALL_DISABLED_ACCOUNTS)
 
 
 def send_re_enable_disabled_proxy(proxy_id):
     """Отправление прокси на перезапуск."""
-    logger.log("send re enabled disabled proxy id: {}".format(proxy_id))
-    celery.send_task(TASK_RE_ENABLE_ALL_DISABLED_PROXY, args=(proxy_id,))
+    logger.item("send_re_enable_disabled_proxy", "send re enabled disabled proxy", proxy_id=proxy_id)
+    publisher.publish(TASK_RE_ENABLE_ALL_DISABLED_PROXY, args=(proxy_id,))
 
 
 def send_subtask_like(subtask_id, countdown=None):
     """Отправление позадачи лайк."""
-    logger.log("send like subtask_id: {}".format(subtask_id))
-    celery.send_task(SUB_TASK_POST_LIKES, args=(subtask_id,), countdown=countdown)
+    logger.item("send_like", "send like", subtask_id=subtask_id)
+    DISPATCHED.labels('like').inc()
+    publish_dispatch(SUB_TASK_POST_LIKES, args=(subtask_id,), countdown=countdown)
 
 
 def send_subtask_comment(subtask_id, countdown=None):
     """Отправление позадачи коммент."""
-    logger.log("send comment subtask_id: {}".format(subtask_id))
-    celery.send_task(SUB_TASK_POST_COMMENTS, args=(subtask_id,), countdown=countdown)
+    logger.item("send_comment", "send comment", subtask_id=subtask_id)
+    DISPATCHED.labels('comment').inc()
+    publish_dispatch(SUB_TASK_POST_COMMENTS, args=(subtask_id,), countdown=countdown)
 
 
 def send_subtask_share(subtask_id, countdown=None):
     """Отправление позадачи шэринга."""
-    logger.log("send shares subtask_id: {}".format(subtask_id))
-    celery.send_task(SUB_TASK_POST_SHARES, args=(subtask_id,), countdown=countdown)
+    logger.item("send_share", "send shares", subtask_id=subtask_id)
+    DISPATCHED.labels('share').inc()
+    publish_dispatch(SUB_TASK_POST_SHARES, args=(subtask_id,), countdown=countdown)
 
 
 def send_subtask_personal_page(subtask_id, countdown=None):
     """Отправление позадачи по извлечению личной страницы."""
-    logger.log("send personal page subtask_id: {}".format(subtask_id))
-    celery.send_task(SUB_TASK_PERSONAL_PAGE, args=(subtask_id,), countdown=countdown)
+    logger.item("send_personal_page", "send personal page", subtask_id=subtask_id)
+    DISPATCHED.labels('personal_page').inc()
+    publish_dispatch(SUB_TASK_PERSONAL_PAGE, args=(subtask_id,), countdown=countdown)
 
 
-def send_subtask(subtask):
-    """Отправление подзадачи."""
-    change_subtask_status(subtask)
+SUBTASK_SENDERS = {
+    SubtaskType.like: send_subtask_like,
+    SubtaskType.comment: send_subtask_comment,
+    SubtaskType.share: send_subtask_share,
+    SubtaskType.personal_page: send_subtask_personal_page,
+}
 
-    if subtask.subtask_type == SubtaskType.like:
-        send_subtask_like(subtask.id)
 
-    if subtask.subtask_type == SubtaskType.comment:
-        send_subtask_comment(subtask.id)
+SUBTASK_BATCH_TASKS = {
+    SubtaskType.like: SUB_TASK_POST_LIKES_IDS,
+    SubtaskType.comment: SUB_TASK_POST_COMMENTS_IDS,
+    SubtaskType.share: SUB_TASK_POST_SHARES_IDS,
+    SubtaskType.personal_page: SUB_TASK_PERSONAL_PAGE_IDS,
+}
 
-    if subtask.subtask_type == SubtaskType.share:
-        send_subtask_share(subtask.id)
 
-    if subtask.subtask_type == SubtaskType.personal_page:
-        send_subtask_personal_page(subtask.id)
+def publish_subtasks(subtask_type, subtask_ids):
+    """Публикация захваченных подзадач одного типа одним сообщением."""
+    logger.item("send_subtasks", "send subtasks", subtask_type=subtask_type.value,
+                count=len(subtask_ids))
+    DISPATCHED.labels(subtask_type.value).inc(len(subtask_ids))
+    publish_ids(SUBTASK_BATCH_TASKS[subtask_type], subtask_ids)
+
+
+def send_subtask(subtask):
+    """Отправление подзадачи."""
+    change_subtask_status(subtask)
+    SUBTASK_SENDERS[subtask.subtask_type](subtask.id)
@@ -0,0 +1,136 @@
+import threading
+import time
+
+from .fair_share import DeficitRoundRobin
+
+# Типы, квота которых делится между приоритетами задач
+PRIORITIZED_TYPES = ('keyword', 'source')
+
+
+class RateCap:
+    """Ограничение скорости отправки типа: rate сообщений в секунду.
+
+    Неизрасходованный запас копится не больше чем на burst секунд, поэтому
+    за тик уходит не больше rate * burst сообщений, а за длинный период -
+    в среднем не больше rate в секунду. Запас резервируется до отправки,
+    поэтому check_tasks и слушатель NOTIFY не расходуют его дважды.
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = rate * burst
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self, limit):
+        """Резерв не больше limit сообщений из накопленного запаса."""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            reserved = max(0, min(limit, int(self.tokens)))
+            self.tokens -= reserved
+            return reserved
+
+    def refund(self, count):
+        """Возврат неизрасходованной части резерва."""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + count)
+
+
+class DispatchPolicy:
+    """Решения тика планировщика: сколько и каких задач отправить.
+
+    Не обращается к БД и брокеру, поэтому одна и та же логика работает в
+    scheduler_service и в симуляторе (benchmark.simulator). Отправка
+    выполняется функцией send(name, limit, quotas): для подзадач quotas -
+    None, результат - количество отправленного; для задач quotas -
+    {приоритет: квота}, результат - {приоритет: отправлено}.
+    """
+
+    def __init__(self, weights, priority_weights, min_available_wc, backpressure=None,
+                 rate_caps=None, rate_burst=30, clock=time.monotonic, take_published=None):
+        self.fair_share = DeficitRoundRobin(weights)
+        self.priority_shares = {
+            name: DeficitRoundRobin(priority_weights) for name in PRIORITIZED_TYPES
+        }
+        self.min_available_wc = min_available_wc
+        self.backpressure = backpressure
+        self.rate_caps = {
+            name: RateCap(rate, rate_burst, clock)
+            for name, rate in (rate_caps or {}).items() if rate > 0
+        }
+        # Количество опубликованных потоком сообщений с прошлого вызова; без
+        # него backpressure считает, что одна задача - одно сообщение
+        self.take_published = take_published
+
+    def tick(self, available_wc, send, get_queue_depth, summary):
+        """Периодическая отправка; итоги по типам складываются в summary."""
+        if available_wc < self.min_available_wc:
+            return 0
+
+        dispatch_count = available_wc
+        if self.backpressure is not None:
+            summary['queue_depth'] = get_queue_depth()
+            summary['allowed'] = self.backpressure.update(summary['queue_depth'])
+            dispatch_count = min(available_wc, summary['allowed'])
+
+        sent = self.dispatch(dispatch_count, send)
+        summary.update(sent)
+        return sum(sent.values())
+
+    def dispatch(self, count, send, names=None):
+        """Раздача count слотов между типами names (по умолчанию - всеми)."""
+        if self.take_published is not None:
+            self.take_published()
+        sent = self.fair_share.schedule(
+            count,
+            lambda name, limit: self.dispatch_type(name, limit, send),
+            names
+        )
+        if self.backpressure is not None:
+            if self.take_published is not None:
+                self.backpressure.dispatched(self.take_published())
+            else:
+                self.backpressure.dispatched(sum(sent.values()))
+        return sent
+
+    def dispatch_type(self, name, limit, send):
+        """Квота типа; для задач делится между приоритетами по их весам.
+
+        Квота сверх ограничения скорости типа достаётся другим типам.
+        """
+        rate_cap = self.rate_caps.get(name)
+        if rate_cap is not None:
+            limit = rate_cap.reserve(limit)
+            if limit <= 0:
+                return 0
+
+        if name not in self.priority_shares:
+            sent = send(name, limit, None)
+        else:
+            sent = self.dispatch_priorities(name, limit, send)
+
+        if rate_cap is not None:
+            rate_cap.refund(limit - sent)
+        return sent
+
+    def dispatch_priorities(self, name, limit, send):
+        """Отправка задач всех приоритетов одним вызовом send.
+
+        Квоты приоритетов считаются по весам, send(name, limit, quotas)
+        возвращает отправленное по приоритетам. Квоту приоритета без готовых
+        задач send добирает задачами остальных приоритетов в порядке очереди,
+        а дефицит такого приоритета сбрасывается.
+        """
+        shares = self.priority_shares[name]
+        if not shares.weights:
+            return 0
+        quotas = shares.allocate(limit, list(shares.weights))
+        sent = send(name, limit, quotas)
+        for priority, quota in quotas.items():
+            if sent.get(priority, 0) < quota:
+                shares.exhausted(priority)
+        return sum(sent.values())
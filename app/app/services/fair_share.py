@@ -0,0 +1,75 @@
+import math
+import threading
+
+
+class DeficitRoundRobin:
+    """Распределение свободных рабочих аккаунтов между типами задач (DRR).
+
+    Каждый тип с ненулевым весом получает долю ёмкости пропорционально весу.
+    Дробные остатки копятся в дефиците типа и переходят на следующие тики,
+    поэтому малые веса тоже получают своё. Если тип отправил меньше квоты,
+    его очередь пуста: дефицит сбрасывается, а недоиспользованная ёмкость
+    делится между остальными типами в следующем раунде того же тика.
+    """
+
+    def __init__(self, weights):
+        self.weights = {name: weight for name, weight in weights.items() if weight > 0}
+        self.deficits = {name: 0.0 for name in self.weights}
+        self.lock = threading.Lock()
+
+    def allocate(self, capacity, active):
+        """Квоты типов из active на capacity слотов; сумма квот равна capacity.
+
+        Дефицит бывает отрицательным (тип получил слот округления авансом) и
+        больше доли тика (копился, пока тип не был в active), поэтому квоты
+        после округления вниз подравниваются до capacity по одному слоту.
+        """
+        with self.lock:
+            total_weight = sum(self.weights[name] for name in active)
+            for name in active:
+                self.deficits[name] += capacity * self.weights[name] / total_weight
+
+            quotas = {name: max(math.floor(self.deficits[name]), 0) for name in active}
+            excess = sum(quotas.values()) - capacity
+            while excess < 0:
+                # Недостающий слот - типу с наибольшим дефицитом сверх квоты
+                name = max(active, key=lambda name: self.deficits[name] - quotas[name])
+                quotas[name] += 1
+                excess += 1
+            while excess > 0:
+                # Лишний слот снимается с типа с наименьшим дефицитом сверх квоты
+                name = min((name for name in active if quotas[name] > 0),
+                           key=lambda name: self.deficits[name] - quotas[name])
+                quotas[name] -= 1
+                excess -= 1
+
+            for name, quota in quotas.items():
+                self.deficits[name] -= quota
+            return quotas
+
+    def schedule(self, capacity, dispatch, names=None):
+        """Раздача capacity слотов через dispatch(name, limit) -> отправлено.
+
+        names ограничивает набор типов (например, только те, о которых
+        пришли уведомления). Возвращает количество отправленного по типам.
+        """
+        active = [name for name in self.weights if names is None or name in names]
+        sent = {name: 0 for name in active}
+        while capacity > 0 and active:
+            quotas = self.allocate(capacity, active)
+            for name in list(active):
+                quota = quotas[name]
+                if quota == 0:
+                    continue
+                count = dispatch(name, quota)
+                sent[name] += count
+                capacity -= count
+                if count < quota:
+                    active.remove(name)
+                    self.exhausted(name)
+        return sent
+
+    def exhausted(self, name):
+        """Очередь типа опустела: накопленный дефицит не переносится."""
+        with self.lock:
+            self.deficits[name] = 0.0
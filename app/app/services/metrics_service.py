@@ -0,0 +1,131 @@
+import sys
+import time
+
+from prometheus_client import REGISTRY, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+from ..database import db
+from ..database.tasks_dao import READINESS_TIERS, get_tasks_readiness_counts
+from ..main import app, logger
+from ..utils.logging import get_handler
+from ..utils.metrics import QUERY_DURATION
+
+PACKAGE = __name__.rsplit('.', 2)[0]
+readiness_collector = None
+log_collector = None
+DAO_MODULES = (
+    PACKAGE + '.database.tasks_dao',
+    PACKAGE + '.database.worker_credentials_dao',
+)
+# Функция DAO по тексту запроса: обход стека делается один раз на запрос,
+# а не на каждое выполнение. Запросы с переменной длиной IN (...) дают много
+# разных текстов, поэтому размер кэша ограничен
+QUERY_FUNCTIONS = {}
+QUERY_FUNCTIONS_SIZE = 1000
+
+
+def get_dao_function():
+    """Имя функции DAO, выполняющей запрос.
+
+    Если запрос собран в DAO, а выполнен в сервисе (например, в send),
+    берётся ближайшая функция пакета.
+    """
+    caller = 'other'
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module in DAO_MODULES:
+            return frame.f_code.co_name
+        if caller == 'other' and module.startswith(PACKAGE + '.') and module != __name__:
+            caller = frame.f_code.co_name
+        frame = frame.f_back
+    return caller
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_start_time = time.monotonic()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    function = QUERY_FUNCTIONS.get(statement)
+    if function is None:
+        function = get_dao_function()
+        if len(QUERY_FUNCTIONS) < QUERY_FUNCTIONS_SIZE:
+            QUERY_FUNCTIONS[statement] = function
+    QUERY_DURATION.labels(function).observe(
+        time.monotonic() - context.query_start_time
+    )
+
+
+class ReadinessCollector:
+    """Количество готовых задач по уровням get_tasks_query на момент опроса."""
+
+    def describe(self):
+        yield self.gauge()
+
+    def collect(self):
+        # Опрос приходит в поток HTTP-сервера метрик, вне контекста приложения
+        with app.app_context():
+            try:
+                counts = get_tasks_readiness_counts()
+            except Exception:
+                logger.warning("Readiness metrics are unavailable", exc_info=True)
+                return
+            finally:
+                db.session.remove()
+
+        gauge = self.gauge()
+        for tier in READINESS_TIERS.values():
+            gauge.add_metric([tier], counts.get(tier, 0))
+        yield gauge
+
+    def gauge(self):
+        return GaugeMetricFamily(
+            'fb_producer_ready_tasks',
+            'Задачи, готовые к отправке, по уровням',
+            labels=['tier']
+        )
+
+
+class LogCollector:
+    """Записи лога, потерянные при переполнении очереди логгера."""
+
+    def describe(self):
+        yield self.counter()
+
+    def collect(self):
+        counter = self.counter()
+        counter.add_metric([], get_handler().dropped)
+        yield counter
+
+    def counter(self):
+        return CounterMetricFamily(
+            'fb_producer_log_dropped',
+            'Записи лога, потерянные из-за переполнения очереди LOG_QUEUE_SIZE'
+        )
+
+
+def init_metrics(readiness=False):
+    """Замер SQL-запросов, потери лога и, для процесса планировщика, метрика готовых задач.
+
+    Вызывается при старте процесса, а не при импорте: обращение к db.engine
+    создаёт engine. Метрики отдаёт только сервер планировщика
+    (SCHEDULER_METRICS_PORT): у каждого воркера uwsgi свой реестр, и счётчики
+    с /metrics API зависели бы от того, какой воркер ответил.
+    """
+    global readiness_collector, log_collector
+    if not event.contains(db.engine, 'after_cursor_execute', after_cursor_execute):
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+    if log_collector is None:
+        log_collector = LogCollector()
+        REGISTRY.register(log_collector)
+    if readiness and readiness_collector is None:
+        readiness_collector = ReadinessCollector()
+        REGISTRY.register(readiness_collector)
+
+
+def start_metrics_server(port):
+    """Отдельный HTTP-сервер метрик для процесса планировщика."""
+    start_http_server(port)
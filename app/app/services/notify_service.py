@@ -0,0 +1,88 @@
+import select
+import threading
+import time
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from ..database import db
+from ..database.models import SubtaskType
+from ..database.schema import (DISPATCH_NOTIFY_CHANNEL,
+                               DISPATCH_NOTIFY_TRIGGERS, apply_schema)
+from ..main import app, logger
+
+RECONNECT_TIMEOUT = 5
+
+
+def parse_notifications(payloads):
+    """Разбор сообщений NOTIFY в множества id задач и подзадач по типам."""
+    task_ids = set()
+    subtask_ids = {}
+    for payload in payloads:
+        parts = payload.split(':')
+        if parts[0] == 'task' and len(parts) == 2:
+            task_ids.add(int(parts[1]))
+        elif parts[0] == 'subtask' and len(parts) == 3:
+            subtask_ids.setdefault(SubtaskType(parts[1]), set()).add(int(parts[2]))
+    return task_ids, subtask_ids
+
+
+class DispatchListener(threading.Thread):
+    """Поток, слушающий канал NOTIFY и сразу отправляющий затронутые задачи.
+
+    Уведомления, пришедшие в течение debounce секунд, обрабатываются одной
+    пачкой. Периодическая проверка check_tasks остаётся страховкой на случай
+    потерянных уведомлений и переподключений.
+    """
+
+    def __init__(self, dispatch_function, debounce):
+        super().__init__(daemon=True)
+        self.dispatch_function = dispatch_function
+        self.debounce = debounce
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                logger.error("Dispatch listener error. Reconnecting", exc_info=True)
+                time.sleep(RECONNECT_TIMEOUT)
+
+    def listen(self):
+        connection = db.engine.raw_connection()
+        try:
+            connection.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = connection.cursor()
+            cursor.execute("LISTEN {}".format(DISPATCH_NOTIFY_CHANNEL))
+            logger.info("Listening for notifications", channel=DISPATCH_NOTIFY_CHANNEL)
+
+            while True:
+                if select.select([connection.connection], [], [], 60) == ([], [], []):
+                    continue
+                time.sleep(self.debounce)
+                payloads = self.drain(connection.connection)
+                if payloads:
+                    self.dispatch(payloads)
+        finally:
+            connection.invalidate()
+
+    def drain(self, dbapi_connection):
+        dbapi_connection.poll()
+        payloads = [notify.payload for notify in dbapi_connection.notifies]
+        del dbapi_connection.notifies[:]
+        return payloads
+
+    def dispatch(self, payloads):
+        task_ids, subtask_ids = parse_notifications(payloads)
+        with app.app_context():
+            try:
+                self.dispatch_function(task_ids, subtask_ids)
+            except Exception:
+                logger.error("Error appeared in notified dispatch. Continue listening", exc_info=True)
+
+
+def start_listener(dispatch_function, debounce):
+    """Установка триггеров NOTIFY и запуск потока-слушателя."""
+    apply_schema(DISPATCH_NOTIFY_TRIGGERS)
+    listener = DispatchListener(dispatch_function, debounce)
+    listener.start()
+    return listener
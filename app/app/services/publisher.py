@@ -0,0 +1,206 @@
+import threading
+import time
+from weakref import WeakKeyDictionary
+
+from ..main import logger
+
+
+class PublishConfirms:
+    """Учёт подтверждений публикации (publisher confirms) на канале брокера.
+
+    Для каждого номера доставки хранится сообщение, поэтому отклонённые
+    брокером (nack) и неподтверждённые сообщения известны поимённо. Номера
+    доставки идут с 1 от confirm_select, поэтому учёт действителен, пока
+    канал не переоткрыт.
+    """
+
+    def __init__(self, channel):
+        self.next_delivery_tag = 1
+        self.outstanding = {}
+        self.nacked = []
+        channel.confirm_select()
+        channel.events['basic_ack'].add(self.on_ack)
+        channel.events['basic_nack'].add(self.on_nack)
+
+    def attached(self, channel):
+        """Канал не закрывался с момента confirm_select.
+
+        При закрытии канал py-amqp сбрасывает обработчики событий, а при
+        переоткрытии (revive) нумерация доставок начинается заново.
+        """
+        return getattr(channel, 'is_open', True) and self.on_ack in channel.events['basic_ack']
+
+    def published(self, message):
+        self.outstanding[self.next_delivery_tag] = message
+        self.next_delivery_tag += 1
+
+    def settle(self, delivery_tag, multiple):
+        if multiple:
+            tags = [tag for tag in self.outstanding if tag <= delivery_tag]
+        else:
+            tags = [delivery_tag] if delivery_tag in self.outstanding else []
+        return [self.outstanding.pop(tag) for tag in tags]
+
+    def on_ack(self, delivery_tag, multiple):
+        self.settle(delivery_tag, multiple)
+
+    def on_nack(self, delivery_tag, multiple):
+        self.nacked.extend(self.settle(delivery_tag, multiple))
+
+    def reset(self):
+        """Отклонённые и неподтверждённые сообщения с очисткой учёта."""
+        nacked, self.nacked = self.nacked, []
+        unconfirmed = list(self.outstanding.values())
+        self.outstanding.clear()
+        return nacked, unconfirmed
+
+
+class Publisher:
+    """Буферизованная публикация задач celery.
+
+    Сообщения копятся в буфере и отправляются пачкой через продюсера из
+    ограниченного пула celery. Подтверждения брокера ждутся один раз на
+    пачку, а не на каждое сообщение. Транспорты без publisher confirms
+    (например memory://) публикуют пачку без ожидания. С ignore_result
+    продюсер не регистрирует ожидание результата в backend'е.
+    """
+
+    def __init__(self, celery, flush_size=100, flush_interval=1.0,
+                 confirm_timeout=5.0, ignore_result=False, on_flush=None):
+        self.celery = celery
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.confirm_timeout = confirm_timeout
+        self.ignore_result = ignore_result
+        self.on_flush = on_flush
+        self.buffer = []
+        self.lock = threading.RLock()
+        self.last_flush = time.monotonic()
+        self.confirms = WeakKeyDictionary()
+        self.flusher = None
+
+        self.published_count = 0
+        self.requeued_count = 0
+        self.unconfirmed_count = 0
+        self.last_flush_size = 0
+        self.last_flush_latency = 0.0
+
+    def publish(self, name, args=None, countdown=None, **options):
+        """Постановка сообщения в буфер с отправкой при заполнении."""
+        with self.lock:
+            self.buffer.append((name, args, countdown, options))
+            flush = len(self.buffer) >= self.flush_size or self.flush_due()
+            if not flush:
+                self.start_flusher()
+        if flush:
+            self.flush()
+
+    def flush_due(self):
+        return time.monotonic() - self.last_flush >= self.flush_interval
+
+    def flush(self):
+        """Отправка всего буфера одной пачкой; возвращает число отправленных сообщений.
+
+        Сообщения, которые не удалось отправить из-за ошибки брокера, и
+        отклонённые брокером (nack) возвращаются в начало буфера и уходят со
+        следующим сбросом. Сообщения без подтверждения за confirm_timeout
+        пишутся в лог и не повторяются, чтобы задача не ушла дважды: если они
+        потерялись, задачу вернёт в очередь reclaim_expired.
+
+        Блокировка держится только на время подмены буфера, отправка и
+        ожидание подтверждений идут без неё и не задерживают publish().
+        """
+        with self.lock:
+            messages, self.buffer = self.buffer, []
+            self.last_flush = time.monotonic()
+        if not messages:
+            return 0
+
+        started = time.monotonic()
+        sent = 0
+        nacked, unconfirmed = [], []
+        try:
+            with self.celery.producer_pool.acquire(block=True) as producer:
+                confirms = self.get_confirms(producer.channel)
+                try:
+                    for message in messages:
+                        name, args, countdown, options = message
+                        self.celery.send_task(
+                            name,
+                            args=args,
+                            countdown=countdown,
+                            producer=producer,
+                            ignore_result=self.ignore_result,
+                            **options
+                        )
+                        sent += 1
+                        if confirms is not None:
+                            confirms.published(message)
+                    if confirms is not None:
+                        self.wait_for_confirms(producer.connection, confirms)
+                finally:
+                    if confirms is not None:
+                        nacked, unconfirmed = confirms.reset()
+        except Exception:
+            logger.error("Messages are not published", exc_info=True,
+                         unsent=len(messages) - sent)
+
+        self.requeue(nacked + messages[sent:])
+        for name, args, _, _ in unconfirmed:
+            logger.item("unconfirmed_message", "message is not confirmed by broker",
+                        task=name, args=args)
+
+        published = sent - len(nacked)
+        with self.lock:
+            self.unconfirmed_count += len(unconfirmed)
+            self.published_count += published
+            self.last_flush_size = published
+            self.last_flush_latency = time.monotonic() - started
+        if self.on_flush is not None:
+            self.on_flush(published, self.last_flush_latency)
+        return published
+
+    def requeue(self, messages):
+        """Возврат неотправленных сообщений в начало буфера."""
+        if messages:
+            with self.lock:
+                self.buffer[:0] = messages
+                self.requeued_count += len(messages)
+            logger.item("requeued_messages", "messages are returned to publisher buffer",
+                        count=len(messages))
+
+    def get_confirms(self, channel):
+        if not hasattr(channel, 'confirm_select'):
+            return None
+        with self.lock:
+            confirms = self.confirms.get(channel)
+            if confirms is None or not confirms.attached(channel):
+                confirms = self.confirms[channel] = PublishConfirms(channel)
+            return confirms
+
+    def wait_for_confirms(self, connection, confirms):
+        deadline = time.monotonic() + self.confirm_timeout
+        while confirms.outstanding and time.monotonic() < deadline:
+            try:
+                connection.drain_events(timeout=deadline - time.monotonic())
+            except Exception:
+                break
+
+    def start_flusher(self):
+        """Фоновый сброс буфера, чтобы сообщения не залёживались дольше интервала."""
+        if self.flusher is not None and self.flusher.is_alive():
+            return
+        self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+        self.flusher.start()
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            with self.lock:
+                if not self.buffer:
+                    self.flusher = None
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.error("Background flush failed", exc_info=True)
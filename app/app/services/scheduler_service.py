@@ -1,129 +1,217 @@
-import traceback
+import functools
+import time
 from datetime import timedelta
 from random import randint
 
 from timeloop import Timeloop
 
-from ..database.tasks_dao import (get_available_wc, get_comments_to_sent,
-                                  get_keywords_ready_to_sent,
-                                  get_like_ready_to_sent,
-                                  get_personal_data_to_sent,
-                                  get_share_ready_to_sent,
-                                  get_sources_ready_to_sent)
+from ..database.models import SubtaskType
+from ..database.schema import (SCHEMA_UPGRADES, SUBTASK_TASK_ID_BACKFILL,
+                               apply_schema_upgrades,
+                               backfill_subtask_task_ids, is_backfill_finished)
+from ..database.tasks_dao import (claim_keywords_ready_to_sent,
+                                  claim_sources_ready_to_sent, claim_subtasks,
+                                  get_available_wc, reclaim_expired_leases)
 from ..database.worker_credentials_dao import free_frozen_credentials
-from ..main import logger
-from .celery_service import (send, send_keyword_by_task, send_source_by_task,
-                             send_subtask)
+from ..main import CHECK_TASKS_INTERVAL, app, logger
+from ..utils.metrics import (CHECK_TASKS_DURATION, CHECK_TASKS_OVERRUNS,
+                             RECLAIMED)
+from .backpressure import BackpressureController
+from .celery_service import (SUBTASK_SENDERS, flush_published, get_queue_depth,
+                             publish_keyword, publish_keywords, publish_source,
+                             publish_sources, publish_subtasks, send_batch,
+                             send_keywords, send_sources, send_subtasks,
+                             send_tasks_batch, stop_spreader,
+                             take_published_messages)
 from .credentials_management import accounts_warming, proxy_re_enable
+from .dispatch_policy import DispatchPolicy
+from .notify_service import start_listener
 
-TASK_PERCENTAGE = 100
-SUBTASK_LIKE_PERCENTAGE = 0
-SUBTASK_COMMENT_PERCENTAGE = 10
-SUBTASK_SHARE_PERCENTAGE = 0
-SUBTASK_PERSONAL_DATA_PERCENTAGE = 0
+RECLAIM_BATCH_SIZE = 1000
+# Диапазонов по BACKFILL_BATCH_SIZE подзадач за один запуск backfill_subtasks
+BACKFILL_BATCHES_PER_RUN = 10
 tl = Timeloop()
-
-
-@tl.job(interval=timedelta(seconds=30))
+backpressure = BackpressureController(
+    target_depth=app.config['BACKPRESSURE_TARGET_DEPTH'],
+    min_limit=app.config['BACKPRESSURE_MIN_LIMIT'],
+    max_limit=app.config['BACKPRESSURE_MAX_LIMIT'],
+    additive_step=app.config['BACKPRESSURE_ADDITIVE_STEP'],
+    decrease_factor=app.config['BACKPRESSURE_DECREASE_FACTOR'],
+    ewma_alpha=app.config['BACKPRESSURE_EWMA_ALPHA'],
+    tick_interval=CHECK_TASKS_INTERVAL
+)
+
+
+def scheduled_job(interval):
+    """Регистрация задачи Timeloop, выполняемой в собственном контексте приложения.
+
+    Каждый запуск получает свою сессию БД, которая закрывается при выходе из
+    контекста, а исключение не останавливает поток задачи.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def run():
+            with app.app_context():
+                try:
+                    function()
+                except Exception:
+                    logger.error("Scheduled job failed", job=function.__name__, exc_info=True)
+
+        tl.job(interval=interval)(run)
+        return function
+    return decorator
+
+
+policy = DispatchPolicy(
+    app.config['DISPATCH_WEIGHTS'],
+    app.config['DISPATCH_PRIORITY_WEIGHTS'],
+    app.config['MIN_AVAILABLE_WC'],
+    backpressure if app.config['BACKPRESSURE_ENABLED'] else None,
+    rate_caps=app.config['DISPATCH_RATE_CAPS'],
+    rate_burst=CHECK_TASKS_INTERVAL,
+    take_published=take_published_messages
+)
+
+
+@scheduled_job(interval=timedelta(seconds=CHECK_TASKS_INTERVAL))
 def check_tasks():
     """Задача проверки количества аккаунтов и распределения работы между ними."""
+    started = time.monotonic()
+    summary = {}
+    try:
+        send_ready_tasks(summary)
+    finally:
+        duration = time.monotonic() - started
+        CHECK_TASKS_DURATION.observe(duration)
+        if duration > CHECK_TASKS_INTERVAL:
+            CHECK_TASKS_OVERRUNS.inc()
+        logger.info("check_tasks tick", duration=round(duration, 3), **summary)
+
+
+def send_ready_tasks(summary):
+    """Распределение свободных рабочих аккаунтов и отправка готовых задач.
+
+    Итоги тика складываются в summary для одной сводной записи в лог.
+    """
     available_wc = get_available_wc()
-    logger.log("available_wc: {}".format(available_wc))
-    # TODO: Refactor this
-    if available_wc <= 3:
-        return
+    summary['available_wc'] = available_wc
 
     try:
-        logger.log("start send schedule tasks")
-        task_count, like_count, share_count, personal_data_count, comment_count = split_wc_between_tasks(
-            get_available_wc())
-        logger.log(
-            "free wc for tasks: {}, like: {}, share: {}, personal_data: {}, comments: {}".format(
-                task_count,
-                like_count,
-                share_count,
-                personal_data_count,
-                comment_count,
+        if policy.tick(available_wc, send_ready_type, get_queue_depth, summary):
+            summary['published'] = flush_published(CHECK_TASKS_INTERVAL)
+    except Exception:
+        summary['error'] = True
+        logger.error("Error appeared. Continue scheduling", exc_info=True)
+
+
+def send_ready_type(name, limit, quotas):
+    """Отправка не более limit готовых задач типа name."""
+    if name == 'keyword':
+        return send_keywords(limit, quotas)
+    if name == 'source':
+        return send_sources(limit, quotas)
+    return send_subtasks(limit, SubtaskType(name))
+
+
+def dispatch_notified(task_ids, subtask_ids):
+    """Отправка задач и подзадач, о готовности которых сообщил NOTIFY.
+
+    Захват идёт через FOR UPDATE SKIP LOCKED, поэтому отправка безопасна
+    параллельно с check_tasks.
+    """
+    available_wc = get_available_wc()
+    if available_wc < policy.min_available_wc:
+        return
+
+    def send_notified_type(name, limit, quotas):
+        if name == 'keyword':
+            return send_tasks_batch(
+                limit,
+                lambda limit: claim_keywords_ready_to_sent(limit, task_ids, quotas),
+                publish_keyword,
+                publish_keywords
             )
-        )
-#        keywords_count = 0
-        keywords_count = send(
-            task_count,
-            get_keywords_ready_to_sent,
-            send_keyword_by_task
-        )
-        source_count = send(
-            task_count - keywords_count,
-            get_sources_ready_to_sent,
-            send_source_by_task
+        if name == 'source':
+            return send_tasks_batch(
+                limit,
+                lambda limit: claim_sources_ready_to_sent(limit, task_ids, quotas),
+                publish_source,
+                publish_sources
+            )
+        subtask_type = SubtaskType(name)
+        return send_batch(
+            limit,
+            lambda limit: claim_subtasks(subtask_type, limit, subtask_ids[subtask_type]),
+            SUBTASK_SENDERS[subtask_type],
+            lambda claimed_ids: publish_subtasks(subtask_type, claimed_ids)
         )
 
-        subtasks_like_count = send(like_count, get_like_ready_to_sent, send_subtask)
-        subtasks_share_count = send(share_count, get_share_ready_to_sent, send_subtask)
-        subtasks_personal_data_count = send(
-            personal_data_count,
-            get_personal_data_to_sent,
-            send_subtask
-        )
-        subtasks_comment_count = send(comment_count, get_comments_to_sent, send_subtask)
-
-        logger.log("{} keyword, "
-                   "{} source, "
-                   "{} like, "
-                   "{} share, "
-                   "{} personal data, "
-                   "{} comments, "
-                   .format(keywords_count,
-                           source_count,
-                           subtasks_like_count,
-                           subtasks_share_count,
-                           subtasks_personal_data_count,
-                           subtasks_comment_count))
-    except:
-        logger.log("Error appeared. Continue scheduling")
-        traceback.print_exc()
-
-
-@tl.job(interval=timedelta(minutes=5))
+    names = {subtask_type.value for subtask_type in subtask_ids}
+    if task_ids:
+        names.update(('keyword', 'source'))
+    dispatched_count = sum(policy.dispatch(available_wc, send_notified_type, names).values())
+
+    flush_published()
+    logger.info("notified tasks and subtasks sent", dispatched=dispatched_count)
+
+
+@scheduled_job(interval=timedelta(minutes=5))
 def unlock_frozen_credentials():
     """Задача разблокировки замороженных аккаунтов."""
-    print("unlock_frozen_credentials task starts")
+    logger.debug("unlock_frozen_credentials task starts")
     free_frozen_credentials()
 
 
-@tl.job(interval=timedelta(minutes=3))
-def warming_accounts():
-    """Задача прогрева аккаунтов"""
-    print("warming accounts")
-    accounts_warming()
-
+@scheduled_job(interval=timedelta(minutes=1))
+def reclaim_expired():
+    """Задача возврата в retry задач с истёкшей арендой."""
+    task_count, subtask_count = reclaim_expired_leases(RECLAIM_BATCH_SIZE)
+    RECLAIMED.labels('task').inc(task_count)
+    RECLAIMED.labels('subtask').inc(subtask_count)
+    if task_count or subtask_count:
+        logger.info("expired leases reclaimed", tasks=task_count, subtasks=subtask_count)
 
-def split_wc_between_tasks(count):
-    """Вычисление процентного соотношения веса всех типов задач."""
-#    task_count = round((count / 100) * TASK_PERCENTAGE)
-#    subtask_count = count - task_count
 
-#    like_count = round((count / 100) * SUBTASK_LIKE_PERCENTAGE)
-#    share_count = round((count / 100) * SUBTASK_SHARE_PERCENTAGE)
-#    personal_data_count = round((count / 100) * SUBTASK_PERSONAL_DATA_PERCENTAGE)
+@scheduled_job(interval=timedelta(minutes=1))
+def backfill_subtasks():
+    """Задача заполнения subtasks.task_id у старых подзадач, по частям.
 
-#   comment_count = subtask_count - like_count - share_count - personal_data_count
- 
-    #task_count = count
-    task_count = round((count / 100) * TASK_PERCENTAGE)
-    subtask_count = count - task_count
-
-    like_count = 0
-    share_count = 0
-    personal_data_count = 0
-    #personal_data_count = count - task_count
-    #personal_data_count = round((count / 100) * SUBTASK_PERSONAL_DATA_PERCENTAGE)
-    comment_count = subtask_count
-    #comment_count = subtask_count - personal_data_count
+    Долгое заполнение большой таблицы не задерживает запуск планировщика;
+    до его завершения подзадачи задачи ищутся через posts.
+    """
+    if not app.config['SCHEMA_UPGRADES_ENABLED'] or is_backfill_finished(SUBTASK_TASK_ID_BACKFILL):
+        return
+    backfilled = backfill_subtask_task_ids(max_batches=BACKFILL_BATCHES_PER_RUN)
+    if backfilled:
+        logger.info("subtasks.task_id backfilled", rows=backfilled)
 
-#    comment_count = subtask_count - like_count - share_count - personal_data_count
 
-    return task_count, like_count, share_count, personal_data_count, comment_count
+@scheduled_job(interval=timedelta(minutes=3))
+def warming_accounts():
+    """Задача прогрева аккаунтов"""
+    logger.debug("warming accounts")
+    accounts_warming()
 
 
-tl.start()
+def run_scheduler(block=False):
+    """Запуск планировщика: обновление схемы, задачи Timeloop и слушатель NOTIFY.
+
+    Импорт модуля ничего не запускает; планировщик должен работать ровно в
+    одном процессе (python -m app.scheduler). С block=True функция ждёт
+    SIGTERM или SIGINT, останавливает задачи и отправляет сообщения, ещё
+    ждущие в колесе времени.
+    """
+    if app.config['SCHEMA_UPGRADES_ENABLED']:
+        try:
+            apply_schema_upgrades(SCHEMA_UPGRADES)
+        except Exception:
+            logger.error("Schema upgrades are not applied", exc_info=True)
+
+    if app.config['DISPATCH_EVENT_MODE'] and app.config['DATABASE_PGBOUNCER_MODE']:
+        logger.warning("DISPATCH_EVENT_MODE is ignored: LISTEN is not supported through PgBouncer")
+    elif app.config['DISPATCH_EVENT_MODE']:
+        start_listener(dispatch_notified, app.config['DISPATCH_EVENT_DEBOUNCE'])
+
+    tl.start(block=block)
+    if block:
+        stop_spreader()
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from ..main import logger
+
+
+class TimingWheel:
+    """Колесо времени: кольцо из slots ячеек по slot_duration секунд.
+
+    Фоновый поток раз в slot_duration выдаёт в on_due(items) содержимое
+    очередной ячейки. Задержка длиннее оборота колеса попадает в последнюю
+    ячейку. При остановке выдаётся всё, что ещё не наступило.
+    """
+
+    def __init__(self, slots, slot_duration, on_due):
+        self.slots = [[] for _ in range(slots)]
+        self.slot_duration = slot_duration
+        self.on_due = on_due
+        self.cursor = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def schedule(self, delay, item):
+        offset = min(len(self.slots) - 1, int(delay / self.slot_duration))
+        with self.lock:
+            self.slots[(self.cursor + offset) % len(self.slots)].append(item)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def advance(self):
+        with self.lock:
+            items, self.slots[self.cursor] = self.slots[self.cursor], []
+            self.cursor = (self.cursor + 1) % len(self.slots)
+        if items:
+            self.on_due(items)
+
+    def run(self):
+        next_slot = time.monotonic()
+        while True:
+            next_slot += self.slot_duration
+            if self.stopped.wait(max(0.0, next_slot - time.monotonic())):
+                return
+            try:
+                self.advance()
+            except Exception:
+                logger.error("Timing wheel slot is not published", exc_info=True)
+
+    def stop(self):
+        self.stopped.set()
+        with self.lock:
+            items = []
+            for index in range(len(self.slots)):
+                position = (self.cursor + index) % len(self.slots)
+                items.extend(self.slots[position])
+                self.slots[position] = []
+        if items:
+            self.on_due(items)
+
+
+class DispatchSpreader:
+    """Равномерная отправка сообщений тика в течение интервала.
+
+    publish() копит сообщения вызывающего потока, release(window)
+    раскладывает их на window секунд: i-е из n сообщений одной задачи celery
+    уходит со сдвигом i * window / n. В режиме countdown сообщения сразу
+    публикуются с countdown (задержку держит воркер), в режиме wheel - ждут
+    своей ячейки колеса времени в продюсере.
+    """
+
+    def __init__(self, publisher, mode, interval, slots):
+        self.publisher = publisher
+        self.local = threading.local()
+        self.wheel = None
+        if mode == 'wheel':
+            self.wheel = TimingWheel(slots, interval / slots, self.publish_due)
+
+    def publish(self, name, args=None, countdown=None, **options):
+        if not hasattr(self.local, 'pending'):
+            self.local.pending = []
+        self.local.pending.append((name, args, countdown, options))
+
+    def release(self, window):
+        """Раскладка накопленных сообщений на window секунд; 0 - без задержки."""
+        pending, self.local.pending = getattr(self.local, 'pending', []), []
+        by_name = {}
+        for message in pending:
+            by_name.setdefault(message[0], []).append(message)
+
+        for messages in by_name.values():
+            step = window / len(messages)
+            for index, (name, args, countdown, options) in enumerate(messages):
+                delay = index * step
+                if self.wheel is not None and delay:
+                    self.wheel.schedule(delay, (name, args, countdown, options))
+                else:
+                    self.publisher.publish(name, args=args, countdown=(countdown or 0) + delay or None,
+                                           **options)
+        return len(pending)
+
+    def publish_due(self, messages):
+        for name, args, countdown, options in messages:
+            self.publisher.publish(name, args=args, countdown=countdown, **options)
+        self.publisher.flush()
+
+    def stop(self):
+        if self.wheel is not None:
+            self.wheel.stop()
@@ -1,3 +1,172 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Сколько сообщений по отдельным элементам в секунду пропускать на один ключ
+LOG_ITEM_RATE = float(os.environ.get('LOG_ITEM_RATE', 10))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, сообщение и поля."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Запись в ограниченную очередь без блокировки; при переполнении запись теряется.
+
+    Если задан target, фоновый поток, пишущий из очереди в target, запускается
+    при первой записи в каждом процессе: uwsgi импортирует приложение в master
+    и затем делает fork, а потоки при fork не копируются.
+    """
+
+    def __init__(self, log_queue, target=None):
+        super().__init__(log_queue)
+        self.target = target
+        self.dropped = 0
+        self.listener = None
+        self.pid = None
+        self.listener_lock = threading.Lock()
+        if target is not None:
+            atexit.register(self.stop_listener)
+            os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        # Блокировки и очередь родителя могли быть захвачены его потоками в
+        # момент fork, а записи в ней родитель напишет сам
+        self.listener_lock = threading.Lock()
+        self.queue = queue.Queue(self.queue.maxsize)
+
+    def start_listener(self):
+        with self.listener_lock:
+            if self.pid != os.getpid():
+                self.listener = QueueListener(self.queue, self.target)
+                self.listener.start()
+                self.pid = os.getpid()
+
+    def stop_listener(self):
+        with self.listener_lock:
+            if self.listener is not None and self.pid == os.getpid():
+                self.listener.stop()
+                self.listener = None
+                self.pid = None
+
+    def enqueue(self, record):
+        if self.target is not None and self.pid != os.getpid():
+            self.start_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Форматирование выполняется в фоновом потоке
+        return record
+
+
+def get_handler():
+    """Общий обработчик: очередь и фоновый поток, пишущий в stdout."""
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            stream_handler = logging.StreamHandler(sys.stdout)
+            stream_handler.setFormatter(JsonFormatter())
+            _handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE), stream_handler)
+        return _handler
+
+
+class ItemSampler:
+    """Ограничение частоты сообщений по одному ключу (token bucket)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def allow(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.suppressed += 1
+        return False
+
+
 class Log:
-    def log(self, message):
-        print(message)
+    """Структурированный неблокирующий логгер продюсера.
+
+    Записи уходят в очередь и пишутся в stdout фоновым потоком, поэтому
+    вызывающий поток не ждёт ввода-вывода.
+    """
+
+    def __init__(self, name='fb_producer'):
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(LOG_LEVEL)
+        self.logger.propagate = False
+        handler = get_handler()
+        if handler not in self.logger.handlers:
+            self.logger.addHandler(handler)
+        self.samplers = {}
+        self.samplers_lock = threading.Lock()
+
+    def log(self, message, **fields):
+        self.info(message, **fields)
+
+    def debug(self, message, **fields):
+        self.write(logging.DEBUG, message, fields)
+
+    def info(self, message, **fields):
+        self.write(logging.INFO, message, fields)
+
+    def warning(self, message, exc_info=False, **fields):
+        self.write(logging.WARNING, message, fields, exc_info)
+
+    def error(self, message, exc_info=False, **fields):
+        self.write(logging.ERROR, message, fields, exc_info)
+
+    def item(self, key, message, **fields):
+        """Сообщение по отдельному элементу: не чаще LOG_ITEM_RATE в секунду на ключ.
+
+        Число пропущенных сообщений добавляется в следующее записанное.
+        """
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        with self.samplers_lock:
+            sampler = self.samplers.get(key)
+            if sampler is None:
+                sampler = self.samplers[key] = ItemSampler(LOG_ITEM_RATE)
+            if not sampler.allow():
+                return
+            suppressed, sampler.suppressed = sampler.suppressed, 0
+        if suppressed:
+            fields['suppressed'] = suppressed
+        self.write(logging.INFO, message, fields)
+
+    def write(self, level, message, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, message, exc_info=exc_info, extra={'fields': fields})
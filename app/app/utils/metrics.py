@@ -0,0 +1,35 @@
+from prometheus_client import Counter, Histogram
+
+CHECK_TASKS_DURATION = Histogram(
+    'fb_producer_check_tasks_duration_seconds',
+    'Длительность тика check_tasks',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+CHECK_TASKS_OVERRUNS = Counter(
+    'fb_producer_check_tasks_overruns_total',
+    'Тики check_tasks, длившиеся дольше интервала планировщика'
+)
+DISPATCHED = Counter(
+    'fb_producer_dispatched_total',
+    'Отправленные задачи и подзадачи по типам',
+    ['type']
+)
+PUBLISH_DURATION = Histogram(
+    'fb_producer_publish_flush_duration_seconds',
+    'Длительность отправки пачки сообщений в брокер'
+)
+PUBLISHED = Counter(
+    'fb_producer_published_total',
+    'Сообщения, отправленные в брокер'
+)
+RECLAIMED = Counter(
+    'fb_producer_reclaimed_total',
+    'Задачи и подзадачи, возвращённые в retry по истечении аренды',
+    ['type']
+)
+QUERY_DURATION = Histogram(
+    'fb_producer_query_duration_seconds',
+    'Длительность SQL-запросов по функциям DAO',
+    ['function'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
@@ -0,0 +1,262 @@
+"""Бенчмарк тика планировщика.
+
+Запуск из каталога с пакетом app:
+
+    python -m benchmark.scheduler_tick --database-url postgresql://postgres@localhost/bench \\
+        --tasks 100000 --subtasks 100000 --workers 200 --output bench.json
+
+База должна быть локальной и одноразовой (например, docker run postgres).
+Данные создаются в отдельной схеме, которая удаляется после прогона, поэтому
+существующие таблицы не затрагиваются. Брокер - memory:// из kombu.
+
+Результат - JSON с задержкой, количеством SQL-запросов, сообщений в секунду
+и пиковой памятью для check_tasks, get_tasks_query и subtasks_query.
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from urllib.parse import quote
+
+BENCHMARK_SCHEMA = 'fb_producer_benchmark'
+
+SEED_TASKS = """
+INSERT INTO tasks (interval, retro, enabled, priority, status, received_time, finish_time)
+SELECT
+    (ARRAY[5, 60, 1440])[1 + i % 3],
+    now() - interval '30 day',
+    i % 10 <> 0,
+    1 + i % 3,
+    CASE
+        WHEN i % 10 = 0 THEN NULL
+        WHEN i % 10 = 1 THEN 'retry'::taskstatus
+        WHEN i % 10 IN (2, 3) THEN 'in_progress'::taskstatus
+        ELSE 'success'::taskstatus
+    END,
+    now() - (i % 5000) * interval '1 minute',
+    now() - (i % 5000) * interval '1 minute'
+FROM generate_series(1, :count) AS i
+"""
+
+SEED_TASK_TYPES = """
+INSERT INTO tasks_keyword (keyword, task_id)
+SELECT 'keyword ' || id, id FROM tasks WHERE id % 2 = 0;
+INSERT INTO tasks_source (source_id, task_id)
+SELECT 'source ' || id, id FROM tasks WHERE id % 2 = 1;
+"""
+
+SEED_POSTS = """
+INSERT INTO posts (task_id, date)
+SELECT 1 + (i % :tasks), now() FROM generate_series(1, :count) AS i
+"""
+
+SEED_SUBTASKS = """
+INSERT INTO subtasks (post_id, subtask_type, status)
+SELECT
+    1 + (i % :posts),
+    (ARRAY['like', 'comment', 'share', 'personal_page'])[1 + i % 4]::subtasktype,
+    CASE
+        WHEN i % 5 = 0 THEN NULL
+        WHEN i % 5 = 1 THEN 'retry'::taskstatus
+        ELSE 'success'::taskstatus
+    END
+FROM generate_series(1, :count) AS i
+"""
+
+SEED_WORKER_CREDENTIALS = """
+INSERT INTO worker_credentials (account_id, proxy_id, user_agent_id, "inProgress", locked, attemp)
+SELECT i, i, i, false, false, 0 FROM generate_series(1, :count) AS i
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('BENCHMARK_DATABASE_URL'),
+                        help='локальная одноразовая база PostgreSQL')
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--subtasks', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=100,
+                        help='количество свободных рабочих аккаунтов')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--batch-mode', action='store_true',
+                        help='включить DISPATCH_BATCH_MODE')
+    parser.add_argument('--output', help='файл для JSON-результата, по умолчанию stdout')
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url or BENCHMARK_DATABASE_URL is required')
+    return args
+
+
+def configure_environment(args):
+    """Настройка окружения до импорта пакета app."""
+    separator = '&' if '?' in args.database_url else '?'
+    os.environ['FBS_DATABASE_POSTGRESQL_SERVICE_HOST'] = '{}{}options={}'.format(
+        args.database_url,
+        separator,
+        quote('-csearch_path={}'.format(BENCHMARK_SCHEMA))
+    )
+    os.environ['CELERY_BROKER_URL'] = 'memory://'
+    os.environ['CELERY_RESULT_MODE'] = 'ignore'
+    os.environ['DISPATCH_EVENT_MODE'] = 'false'
+    os.environ['DISPATCH_BATCH_MODE'] = 'true' if args.batch_mode else 'false'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+
+
+def measure(function, query_counter, repeat):
+    """Задержка, число запросов и пиковая память для каждого вызова."""
+    runs = []
+    for _ in range(repeat):
+        query_counter.count = 0
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        runs.append({
+            'latency_ms': elapsed * 1000,
+            'queries': query_counter.count,
+            'peak_memory_kb': peak / 1024,
+            'result': result,
+        })
+    return runs
+
+
+def summarize(runs):
+    latencies = [run['latency_ms'] for run in runs]
+    return {
+        'latency_ms': {
+            'min': min(latencies),
+            'median': statistics.median(latencies),
+            'max': max(latencies),
+        },
+        'queries': max(run['queries'] for run in runs),
+        'peak_memory_kb': max(run['peak_memory_kb'] for run in runs),
+        'runs': runs,
+    }
+
+
+def seed(db, args):
+    from sqlalchemy import text
+
+    with db.engine.begin() as connection:
+        connection.execute(text('DROP SCHEMA IF EXISTS {} CASCADE'.format(BENCHMARK_SCHEMA)))
+        connection.execute(text('CREATE SCHEMA {}'.format(BENCHMARK_SCHEMA)))
+    db.create_all()
+
+    posts = max(args.subtasks // 10, 1)
+    started = time.perf_counter()
+    with db.engine.begin() as connection:
+        connection.execute(text(SEED_TASKS), count=args.tasks)
+        for statement in SEED_TASK_TYPES.strip().split(';'):
+            if statement.strip():
+                connection.execute(text(statement))
+        connection.execute(text(SEED_POSTS), count=posts, tasks=max(args.tasks, 1))
+        connection.execute(text(SEED_SUBTASKS), count=args.subtasks, posts=posts)
+        connection.execute(text(SEED_WORKER_CREDENTIALS), count=args.workers)
+    with db.engine.connect() as connection:
+        connection.execute(text('ANALYZE'))
+    return time.perf_counter() - started
+
+
+def run(args):
+    from sqlalchemy import event, text
+
+    from app.database import db
+    from app.database.models import SubtaskType
+    from app.database.tasks_dao import get_tasks_query, subtasks_query
+    from app.services import scheduler_service
+    from app.services.celery_service import publisher
+
+    seed_seconds = seed(db, args)
+    query_counter = QueryCounter()
+    event.listen(db.engine, 'before_cursor_execute', query_counter)
+
+    results = {
+        'get_tasks_query': summarize(measure(
+            lambda: len(get_tasks_query().all()),
+            query_counter,
+            args.repeat
+        )),
+    }
+    for subtask_type in SubtaskType:
+        results['subtasks_query.{}'.format(subtask_type.value)] = summarize(measure(
+            lambda: len(subtasks_query(subtask_type).limit(args.workers).all()),
+            query_counter,
+            args.repeat
+        ))
+
+    def tick():
+        published_before = publisher.published_count
+        scheduler_service.check_tasks()
+        publisher.flush()
+        return publisher.published_count - published_before
+
+    tick_runs = measure(tick, query_counter, args.repeat)
+    for tick_run in tick_runs:
+        tick_run['messages'] = tick_run['result']
+        tick_run['messages_per_sec'] = tick_run['result'] / (tick_run['latency_ms'] / 1000)
+    results['check_tasks'] = summarize(tick_runs)
+    results['check_tasks']['messages_per_sec'] = statistics.median(
+        tick_run['messages_per_sec'] for tick_run in tick_runs
+    )
+
+    event.remove(db.engine, 'before_cursor_execute', query_counter)
+    db.session.remove()
+    with db.engine.begin() as connection:
+        connection.execute(text('DROP SCHEMA IF EXISTS {} CASCADE'.format(BENCHMARK_SCHEMA)))
+
+    return {
+        'commit': get_commit(),
+        'timestamp': time.time(),
+        'config': {
+            'tasks': args.tasks,
+            'subtasks': args.subtasks,
+            'workers': args.workers,
+            'repeat': args.repeat,
+            'batch_mode': args.batch_mode,
+        },
+        'seed_seconds': seed_seconds,
+        'results': results,
+    }
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,488 @@
+"""Детерминированный симулятор планировщика с виртуальным временем.
+
+Запуск из каталога с пакетом app:
+
+    python -m benchmark.simulator --hours 6 --workers 50 --seed 1 --output sim.json
+    python -m benchmark.simulator --workload workload.jsonl --hours 24
+
+Решения тика принимает тот же DispatchPolicy, что и scheduler_service: веса
+типов и приоритетов, MIN_AVAILABLE_WC, backpressure, ограничения скорости и
+DISPATCH_SPREAD_MODE читаются из тех же переменных окружения. Вместо БД -
+хранилище в памяти с правилами готовности из app.database.readiness (уровни,
+приоритеты, RETRY_DELAY, порядок), вместо брокера - очередь FIFO, вместо воркеров -
+модель с экспоненциальным временем обработки и вероятностью ошибки. Симуляция детерминирована при одном --seed.
+
+Нагрузка - JSONL, по строке на поступление:
+
+    {"at": 120, "type": "keyword", "count": 10, "priority": 1, "interval": 60}
+
+at - секунды от начала, type - keyword, source, like, comment, share или
+personal_page; priority и interval учитываются только для задач. Текущий
+набор задач из БД можно записать так:
+
+    psql -Atc "SELECT json_build_object('at', 0, 'type',
+        CASE WHEN k.id IS NULL THEN 'source' ELSE 'keyword' END,
+        'priority', t.priority, 'interval', t.interval)
+        FROM tasks t LEFT JOIN tasks_keyword k ON k.task_id = t.id
+        WHERE t.enabled" > workload.jsonl
+
+Без --workload нагрузка генерируется из --seed.
+
+Результат - JSON: пропускная способность, ожидание от готовности до начала
+обработки и голодание по типам, ожидание в брокере и стоимость тика.
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+TASK_TYPES = ('keyword', 'source')
+SUBTASK_TYPES = ('like', 'comment', 'share', 'personal_page')
+START_TIME = datetime(2021, 1, 1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workload', help='JSONL с поступлениями задач и подзадач')
+    parser.add_argument('--hours', type=float, default=6)
+    parser.add_argument('--workers', type=int, default=50,
+                        help='количество рабочих аккаунтов')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--tasks', type=int, default=2000,
+                        help='задач в сгенерированной нагрузке')
+    parser.add_argument('--subtasks-per-hour', type=int, default=500,
+                        help='подзадач каждого типа в час в сгенерированной нагрузке')
+    parser.add_argument('--task-service-time', type=float, default=120,
+                        help='среднее время обработки задачи, сек.')
+    parser.add_argument('--subtask-service-time', type=float, default=30,
+                        help='среднее время обработки подзадачи, сек.')
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    parser.add_argument('--output', help='файл для JSON-результата, по умолчанию stdout')
+    return parser.parse_args()
+
+
+def configure_environment():
+    """Настройка окружения до импорта пакета app: без БД, брокера и логов тиков."""
+    os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+    os.environ.setdefault('CELERY_RESULT_MODE', 'ignore')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+class VirtualClock:
+    def __init__(self, start=START_TIME):
+        self.start = start
+        self.elapsed = 0.0
+
+    def now(self):
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def monotonic(self):
+        return self.elapsed
+
+
+class Item:
+    """Задача или подзадача хранилища."""
+
+    def __init__(self, item_id, item_type, priority=None, interval=None, created=None):
+        self.id = item_id
+        self.type = item_type
+        self.priority = priority
+        self.interval = interval
+        self.enabled = True
+        self.status = None
+        self.received_time = None
+        self.finish_time = None
+        self.ready_since = created
+
+
+def nulls_last(value, default):
+    return (value is None, default if value is None else value)
+
+
+class MemoryStore:
+    """Задачи и подзадачи в памяти с правилами готовности из app.database.readiness."""
+
+    def __init__(self, clock, rules):
+        self.clock = clock
+        self.rules = rules
+        self.items = {}
+        self.next_id = 1
+        self.ranked = []
+        self.scanned = 0
+
+    def add(self, item_type, priority=None, interval=None):
+        item = Item(self.next_id, item_type, priority, interval, self.clock.now())
+        self.items[item.id] = item
+        self.next_id += 1
+        return item
+
+    def priority_condition(self, task, finished_before):
+        return task.priority == 1 or \
+            task.priority in (None,) + self.rules.DELAYED_PRIORITIES and \
+            (task.finish_time is None or task.finish_time < finished_before)
+
+    def interval_passed(self, task, now):
+        return task.received_time is not None and \
+            task.finish_time is not None and task.interval is not None and \
+            task.finish_time + timedelta(minutes=task.interval) < now and \
+            task.enabled and task.status == 'success'
+
+    def check(self, task, check, param, now):
+        """Проверка уровня из TIER_CONDITIONS, как ready_check_condition."""
+        if check == 'new':
+            return task.status is None
+        if check == 'retry':
+            return task.status == 'retry' and \
+                (task.finish_time is None or task.finish_time + param < now)
+        if check == 'interval_passed':
+            return self.interval_passed(task, now)
+        return self.priority_condition(task, now - param)
+
+    def tier(self, task, now):
+        """Уровень готовности как в ready_task_candidates_subquery."""
+        for tier, checks in self.rules.TIER_CONDITIONS.items():
+            if all(self.check(task, check, param, now) for check, param in checks):
+                return tier
+        return None
+
+    def rank(self):
+        """Порядок готовых задач как в ready_tasks_subquery; считается раз за тик."""
+        now = self.clock.now()
+        candidates = []
+        for item in self.items.values():
+            if item.type in TASK_TYPES:
+                self.scanned += 1
+                tier = self.tier(item, now)
+                if tier is not None:
+                    candidates.append((self.rules.task_priority(item.priority), tier, item))
+
+        best_tiers = {}
+        for priority, tier, _ in candidates:
+            best_tiers[priority] = min(tier, best_tiers.get(priority, tier))
+
+        def key(candidate):
+            priority, tier, task = candidate
+            return (priority, tier) + tuple(
+                nulls_last(getattr(task, name), START_TIME)
+                for name in self.rules.tier_order_columns(tier)
+            )
+
+        self.ranked = sorted(
+            (candidate for candidate in candidates if candidate[1] == best_tiers[candidate[0]]),
+            key=key
+        )
+
+    def claim_tasks(self, task_type, limit, quotas):
+        """Захват как в claim_ready_to_sent: сначала задачи в пределах квот приоритетов."""
+        numbers = {}
+        within_quota, over_quota = [], []
+        for priority, _, task in self.ranked:
+            if task.type == task_type and task.status in (None, 'retry', 'success') and \
+                    priority in quotas:
+                numbers[priority] = numbers.get(priority, 0) + 1
+                if numbers[priority] <= quotas[priority]:
+                    within_quota.append((priority, task))
+                else:
+                    over_quota.append((priority, task))
+        claimed = (within_quota + over_quota)[:limit]
+        for _, task in claimed:
+            task.status = 'in_queue'
+        return claimed
+
+    def claim_subtasks(self, subtask_type, limit):
+        backlog = self.subtask_backlog(subtask_type)
+        self.scanned += len(backlog)
+        claimed = sorted(backlog, key=lambda subtask: subtask.id, reverse=True)[:limit]
+        for subtask in claimed:
+            subtask.status = 'in_queue'
+        return claimed
+
+    def subtask_backlog(self, subtask_type):
+        return [item for item in self.items.values()
+                if item.type == subtask_type and item.status in (None, 'retry')]
+
+    def backlog_types(self):
+        """Типы, у которых есть готовые к отправке элементы."""
+        types = {task.type for _, _, task in self.ranked}
+        types.update(item.type for item in self.items.values()
+                     if item.type in SUBTASK_TYPES and item.status in (None, 'retry'))
+        return types
+
+
+class Simulation:
+    def __init__(self, args, clock, policy, rules, account_timeout, tick_interval, spread=False):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.clock = clock
+        self.store = MemoryStore(self.clock, rules)
+        self.policy = policy
+        self.account_timeout = account_timeout
+        self.tick_interval = tick_interval
+        self.spread = spread
+        self.tick_items = []
+        self.retry_delay = rules.RETRY_DELAY
+
+        self.events = []
+        self.sequence = 0
+        self.broker = deque()
+        self.busy_accounts = 0
+        self.cooldowns = []
+
+        self.stats = {name: {
+            'arrived': 0, 'dispatched': 0, 'completed': 0, 'failed': 0,
+            'starved_ticks': 0, 'waits': [],
+        } for name in TASK_TYPES + SUBTASK_TYPES}
+        self.broker_waits = []
+        self.tick_costs = []
+        self.tick_scanned = []
+
+    def schedule(self, delay, kind, payload=None):
+        self.sequence += 1
+        heapq.heappush(self.events, (self.clock.elapsed + delay, self.sequence, kind, payload))
+
+    def available_accounts(self):
+        """Свободные аккаунты после паузы TIMEOUT_BETWEEN_ACCOUNTS_WORK, как в get_available_wc."""
+        while self.cooldowns and self.cooldowns[0] <= self.clock.elapsed:
+            heapq.heappop(self.cooldowns)
+        return self.args.workers - self.busy_accounts - len(self.cooldowns)
+
+    def load(self, arrivals):
+        for arrival in arrivals:
+            self.schedule(arrival['at'], 'arrival', arrival)
+        self.schedule(0, 'tick')
+
+    def run(self):
+        end = self.args.hours * 3600
+        while self.events and self.events[0][0] <= end:
+            self.clock.elapsed, _, kind, payload = heapq.heappop(self.events)
+            getattr(self, 'on_' + kind)(payload)
+            self.consume()
+        self.clock.elapsed = end
+        return self.report()
+
+    def on_arrival(self, arrival):
+        for _ in range(arrival.get('count', 1)):
+            self.store.add(arrival['type'], arrival.get('priority'), arrival.get('interval'))
+        self.stats[arrival['type']]['arrived'] += arrival.get('count', 1)
+
+    def on_tick(self, _):
+        started = time.perf_counter()
+        scanned = self.store.scanned
+        self.store.rank()
+        backlog_types = self.store.backlog_types()
+        summary = {}
+        self.policy.tick(self.available_accounts(), self.send, lambda: len(self.broker), summary)
+        self.release()
+        self.tick_costs.append((time.perf_counter() - started) * 1000)
+        self.tick_scanned.append(self.store.scanned - scanned)
+
+        for name in backlog_types:
+            self.stats[name]['dispatched'] += summary.get(name, 0)
+            if not summary.get(name) and self.available_accounts() > 0:
+                self.stats[name]['starved_ticks'] += 1
+        self.schedule(self.tick_interval, 'tick')
+
+    def send(self, name, limit, quotas):
+        if name in TASK_TYPES:
+            claimed = self.store.claim_tasks(name, limit, quotas)
+            sent = {}
+            for priority, task in claimed:
+                self.tick_items.append(task)
+                sent[priority] = sent.get(priority, 0) + 1
+            return sent
+        items = self.store.claim_subtasks(name, limit)
+        self.tick_items.extend(items)
+        return len(items)
+
+    def release(self):
+        """Сообщения тика в брокер: сразу или по интервалу, как DispatchSpreader."""
+        items, self.tick_items = self.tick_items, []
+        by_type = {}
+        for item in items:
+            by_type.setdefault(item.type, []).append(item)
+        for type_items in by_type.values():
+            step = self.tick_interval / len(type_items) if self.spread else 0
+            for index, item in enumerate(type_items):
+                if index * step:
+                    self.schedule(index * step, 'enqueue', item)
+                else:
+                    self.on_enqueue(item)
+
+    def on_enqueue(self, item):
+        self.broker.append((self.clock.elapsed, item))
+
+    def consume(self):
+        while self.broker and self.available_accounts() > 0:
+            enqueued_at, item = self.broker.popleft()
+            now = self.clock.now()
+            self.broker_waits.append(self.clock.elapsed - enqueued_at)
+            self.stats[item.type]['waits'].append((now - item.ready_since).total_seconds())
+            item.status = 'in_progress'
+            self.busy_accounts += 1
+            mean = self.args.task_service_time if item.type in TASK_TYPES \
+                else self.args.subtask_service_time
+            self.schedule(self.random.expovariate(1 / mean), 'finish', item)
+
+    def on_finish(self, item):
+        now = self.clock.now()
+        self.busy_accounts -= 1
+        heapq.heappush(self.cooldowns, self.clock.elapsed + self.account_timeout)
+        self.schedule(self.account_timeout, 'wake')
+
+        item.finish_time = now
+        if self.random.random() < self.args.failure_rate:
+            self.stats[item.type]['failed'] += 1
+            item.status = 'retry'
+            item.ready_since = now + self.retry_delay if item.type in TASK_TYPES else now
+            return
+
+        self.stats[item.type]['completed'] += 1
+        item.status = 'success'
+        if item.type in TASK_TYPES:
+            item.received_time = now
+            item.ready_since = now + timedelta(minutes=item.interval or 0)
+
+    def on_wake(self, _):
+        pass
+
+    def report(self):
+        hours = self.args.hours
+        types = {}
+        for name, stats in self.stats.items():
+            backlog = sum(1 for item in self.store.items.values()
+                          if item.type == name and item.status in (None, 'retry'))
+            types[name] = {
+                'arrived': stats['arrived'],
+                'dispatched': stats['dispatched'],
+                'completed': stats['completed'],
+                'failed': stats['failed'],
+                'throughput_per_hour': stats['completed'] / hours,
+                'wait_seconds': distribution(stats['waits']),
+                'starved_ticks': stats['starved_ticks'],
+                'backlog_end': backlog,
+            }
+        return {
+            'config': {
+                'hours': hours,
+                'workers': self.args.workers,
+                'seed': self.args.seed,
+                'workload': self.args.workload,
+                'task_service_time': self.args.task_service_time,
+                'subtask_service_time': self.args.subtask_service_time,
+                'failure_rate': self.args.failure_rate,
+            },
+            'ticks': len(self.tick_costs),
+            'types': types,
+            'broker_wait_seconds': distribution(self.broker_waits),
+            'tick_cost': {
+                'wall_ms': distribution(self.tick_costs),
+                'items_scanned': distribution(self.tick_scanned),
+            },
+        }
+
+
+def distribution(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        'mean': sum(values) / len(values),
+        'p50': values[len(values) // 2],
+        'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+        'max': values[-1],
+    }
+
+
+def generate_workload(args):
+    """Нагрузка по умолчанию: набор задач в начале и равномерный поток подзадач."""
+    generator = random.Random(args.seed)
+    arrivals = []
+    for _ in range(args.tasks):
+        arrivals.append({
+            'at': 0,
+            'type': generator.choice(TASK_TYPES),
+            'priority': generator.choices([1, 2, 3, None], weights=[1, 3, 5, 1])[0],
+            'interval': generator.choice([5, 60, 1440]),
+        })
+    duration = args.hours * 3600
+    for subtask_type in SUBTASK_TYPES:
+        count = int(args.subtasks_per_hour * args.hours)
+        for _ in range(count):
+            arrivals.append({'at': generator.uniform(0, duration), 'type': subtask_type})
+    return arrivals
+
+
+def read_workload(path):
+    with open(path) as workload_file:
+        return [json.loads(line) for line in workload_file if line.strip()]
+
+
+def run(args):
+    from app.database import readiness
+    from app.main import (CHECK_TASKS_INTERVAL, TIMEOUT_BETWEEN_ACCOUNTS_WORK,
+                          app)
+    from app.services.backpressure import BackpressureController
+    from app.services.dispatch_policy import DispatchPolicy
+
+    clock = VirtualClock()
+    backpressure = None
+    if app.config['BACKPRESSURE_ENABLED']:
+        backpressure = BackpressureController(
+            target_depth=app.config['BACKPRESSURE_TARGET_DEPTH'],
+            min_limit=app.config['BACKPRESSURE_MIN_LIMIT'],
+            max_limit=app.config['BACKPRESSURE_MAX_LIMIT'],
+            additive_step=app.config['BACKPRESSURE_ADDITIVE_STEP'],
+            decrease_factor=app.config['BACKPRESSURE_DECREASE_FACTOR'],
+            ewma_alpha=app.config['BACKPRESSURE_EWMA_ALPHA'],
+            tick_interval=CHECK_TASKS_INTERVAL,
+            clock=clock.monotonic
+        )
+    policy = DispatchPolicy(
+        app.config['DISPATCH_WEIGHTS'],
+        app.config['DISPATCH_PRIORITY_WEIGHTS'],
+        app.config['MIN_AVAILABLE_WC'],
+        backpressure,
+        rate_caps=app.config['DISPATCH_RATE_CAPS'],
+        rate_burst=CHECK_TASKS_INTERVAL,
+        clock=clock.monotonic
+    )
+
+    simulation = Simulation(
+        args,
+        clock,
+        policy,
+        readiness,
+        account_timeout=TIMEOUT_BETWEEN_ACCOUNTS_WORK * 60,
+        tick_interval=CHECK_TASKS_INTERVAL,
+        spread=app.config['DISPATCH_SPREAD_MODE'] in ('wheel', 'countdown')
+    )
+    simulation.load(read_workload(args.workload) if args.workload else generate_workload(args))
+    report = simulation.run()
+    report['config']['dispatch_weights'] = app.config['DISPATCH_WEIGHTS']
+    report['config']['priority_weights'] = app.config['DISPATCH_PRIORITY_WEIGHTS']
+    report['config']['backpressure'] = backpressure is not None
+    report['config']['rate_caps'] = app.config['DISPATCH_RATE_CAPS']
+    report['config']['spread_mode'] = app.config['DISPATCH_SPREAD_MODE']
+    return report
+
+
+def main():
+    args = parse_args()
+    configure_environment()
+    report = run(args)
+
+    output = json.dumps(report, indent=2, sort_keys=True, default=str)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import os
+import unittest
+
+from ..app.database import db
+from ..app.main import app
+
+# Отдельная БД для тестов; без неё тесты на БД пропускаются. Рабочая БД из
+# FBS_DATABASE_POSTGRESQL_SERVICE_HOST тестами не используется
+TEST_DATABASE_URI = os.environ.get('FBS_TEST_DATABASE_URI')
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Тест на FBS_TEST_DATABASE_URI внутри транзакции, которая откатывается.
+
+    Схема создаётся в той же транзакции, а db.session привязывается к её
+    соединению, поэтому commit в DAO транзакцию не завершает и после теста
+    в БД ничего не остаётся.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        if not TEST_DATABASE_URI:
+            raise unittest.SkipTest('FBS_TEST_DATABASE_URI is not set')
+        cls.database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+        app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URI
+        cls.context = app.app_context()
+        cls.context.push()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.context.pop()
+        app.config['SQLALCHEMY_DATABASE_URI'] = cls.database_uri
+
+    def setUp(self):
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        db.Model.metadata.create_all(self.connection)
+        self.session = db.session
+        db.session = db.create_scoped_session({'bind': self.connection, 'binds': {}})
+
+    def tearDown(self):
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
@@ -0,0 +1,54 @@
+import unittest
+
+from ..app.services.backpressure import BackpressureController
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class BackpressureControllerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.controller = BackpressureController(
+            target_depth=100,
+            initial_limit=50,
+            additive_step=10,
+            decrease_factor=0.5,
+            ewma_alpha=0.5,
+            tick_interval=30,
+            clock=self.clock
+        )
+
+    def tick(self, depth, dispatched):
+        allowed = self.controller.update(depth)
+        self.controller.dispatched(dispatched)
+        self.clock.now += 30
+        return allowed
+
+    def test_grows_additively_while_consumers_keep_up(self):
+        self.assertEqual(self.tick(0, 60), 60)
+        self.assertEqual(self.tick(0, 70), 70)
+        self.assertEqual(self.controller.completion_rate, 2.0)
+
+    def test_backs_off_multiplicatively_when_queue_grows(self):
+        self.tick(0, 60)
+        self.assertEqual(self.tick(150, 0), 0)
+        self.assertEqual(self.controller.limit, 30)
+        self.tick(150, 0)
+        self.assertEqual(self.controller.limit, 15)
+
+    def test_allowance_follows_completion_rate(self):
+        self.tick(100, 100)
+        # потребители разобрали 150 сообщений за 30 секунд
+        allowed = self.tick(50, 0)
+        self.assertEqual(self.controller.completion_rate, 5.0)
+        self.assertEqual(allowed, 70)
+
+
+if __name__ == '__main__':
+    unittest.main()
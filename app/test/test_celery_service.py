@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+
+from ..app.database.models import SubtaskType
+from ..app.main import app
+from ..app.services import celery_service
+from ..app.services.backpressure import BackpressureController
+from ..app.services.dispatch_policy import DispatchPolicy
+
+
+class SendBatchTestCase(unittest.TestCase):
+    def test_publishes_one_message_per_id_by_default(self):
+        publish = mock.Mock()
+        publish_ids = mock.Mock()
+        with mock.patch.dict(app.config, DISPATCH_BATCH_MESSAGES=False):
+            sent = celery_service.send_batch(10, lambda limit: [1, 2, 3], publish, publish_ids)
+        self.assertEqual(sent, 3)
+        self.assertEqual(publish.call_count, 3)
+        publish_ids.assert_not_called()
+
+    def test_splits_claimed_ids_into_batch_messages(self):
+        publish = mock.Mock()
+        publish_ids = mock.Mock()
+        with mock.patch.dict(app.config, DISPATCH_BATCH_MESSAGES=True, DISPATCH_BATCH_MESSAGE_SIZE=2):
+            sent = celery_service.send_batch(10, lambda limit: [1, 2, 3, 4, 5], publish, publish_ids)
+        self.assertEqual(sent, 5)
+        publish.assert_not_called()
+        self.assertEqual([call[0][0] for call in publish_ids.call_args_list], [[1, 2], [3, 4], [5]])
+
+    def test_batch_message_carries_id_list(self):
+        with mock.patch.object(celery_service.publisher, 'publish') as publish:
+            celery_service.publish_subtasks(SubtaskType.comment, [7, 8])
+        publish.assert_called_once_with(
+            celery_service.SUB_TASK_POST_COMMENTS_IDS,
+            args=([7, 8],),
+            serializer=app.config['DISPATCH_BATCH_MESSAGE_SERIALIZER']
+        )
+
+
+class PublishedMessagesTestCase(unittest.TestCase):
+    def test_backpressure_counts_batch_messages(self):
+        backpressure = BackpressureController()
+        policy = DispatchPolicy({'comment': 1}, {}, 1, backpressure,
+                                take_published=celery_service.take_published_messages)
+
+        def send(name, limit, quotas):
+            return celery_service.send_batch(
+                limit,
+                lambda limit: list(range(1, 6)),
+                celery_service.SUBTASK_SENDERS[SubtaskType.comment],
+                lambda subtask_ids: celery_service.publish_subtasks(SubtaskType.comment, subtask_ids)
+            )
+
+        with mock.patch.object(celery_service.publisher, 'publish'), \
+                mock.patch.dict(app.config, DISPATCH_BATCH_MESSAGES=True, DISPATCH_BATCH_MESSAGE_SIZE=2):
+            sent = policy.dispatch(10, send)
+        self.assertEqual(sent, {'comment': 5})
+        self.assertEqual(backpressure.last_dispatched, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
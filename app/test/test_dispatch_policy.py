@@ -0,0 +1,94 @@
+import unittest
+
+from ..app.services.dispatch_policy import DispatchPolicy, RateCap
+
+
+class Backlog:
+    def __init__(self, **sizes):
+        self.sizes = sizes
+        self.calls = []
+
+    def __call__(self, name, limit, quotas):
+        self.calls.append((name, limit, quotas))
+        if quotas is None:
+            return self.take(name, limit)
+
+        sent = {priority: self.take('{0}_{1}'.format(name, priority), quota)
+                for priority, quota in quotas.items()}
+        # Недобор квот - задачами остальных приоритетов в порядке очереди
+        for priority in sorted(quotas):
+            sent[priority] += self.take('{0}_{1}'.format(name, priority),
+                                        limit - sum(sent.values()))
+        return sent
+
+    def take(self, key, limit):
+        count = min(limit, self.sizes.get(key, 0))
+        self.sizes[key] = self.sizes.get(key, 0) - count
+        return count
+
+
+class DispatchPolicyTestCase(unittest.TestCase):
+    def create_policy(self, min_available_wc=4):
+        return DispatchPolicy({'keyword': 1, 'like': 1}, {1: 6, 2: 3, 3: 1}, min_available_wc)
+
+    def test_skips_tick_below_min_available_wc(self):
+        backlog = Backlog(keyword_1=10)
+        summary = {}
+        self.assertEqual(self.create_policy().tick(3, backlog, lambda: 0, summary), 0)
+        self.assertEqual(backlog.calls, [])
+        self.assertEqual(summary, {})
+
+    def test_splits_task_quota_between_priorities(self):
+        backlog = Backlog(keyword_1=100, keyword_2=100, keyword_3=100, like=100)
+        summary = {}
+        sent = self.create_policy().tick(20, backlog, lambda: 0, summary)
+        self.assertEqual(sent, 20)
+        self.assertEqual(summary, {'keyword': 10, 'like': 10})
+        self.assertEqual(backlog.sizes['keyword_1'], 94)
+        self.assertEqual(backlog.sizes['keyword_2'], 97)
+        self.assertEqual(backlog.sizes['keyword_3'], 99)
+
+    def test_rate_cap_limits_type_and_frees_capacity(self):
+        now = [0.0]
+        policy = DispatchPolicy({'keyword': 1, 'like': 1}, {3: 1}, 4,
+                                rate_caps={'like': 0.1}, rate_burst=30, clock=lambda: now[0])
+        backlog = Backlog(keyword_3=100, like=100)
+        summary = {}
+        policy.tick(20, backlog, lambda: 0, summary)
+        self.assertEqual(summary, {'keyword': 17, 'like': 3})
+
+        summary = {}
+        policy.tick(20, backlog, lambda: 0, summary)
+        self.assertEqual(summary['like'], 0)
+
+        now[0] = 30.0
+        summary = {}
+        policy.tick(20, backlog, lambda: 0, summary)
+        self.assertEqual(summary['like'], 3)
+
+    def test_unused_priority_share_goes_to_other_priorities(self):
+        backlog = Backlog(keyword_3=100)
+        summary = {}
+        self.create_policy().tick(10, backlog, lambda: 0, summary)
+        self.assertEqual(summary, {'keyword': 10, 'like': 0})
+
+    def test_claims_all_priorities_in_one_call(self):
+        backlog = Backlog(keyword_1=100, keyword_2=1, keyword_3=100, like=100)
+        self.create_policy().tick(20, backlog, lambda: 0, {})
+        keyword_calls = [call for call in backlog.calls if call[0] == 'keyword']
+        self.assertEqual(keyword_calls, [('keyword', 10, {1: 6, 2: 3, 3: 1})])
+        self.assertEqual(backlog.sizes['keyword_1'], 92)
+        self.assertEqual(backlog.sizes['keyword_2'], 0)
+
+
+class RateCapTestCase(unittest.TestCase):
+    def test_reserved_tokens_are_not_granted_twice(self):
+        rate_cap = RateCap(0.2, 30, clock=lambda: 0.0)
+        self.assertEqual(rate_cap.reserve(5), 5)
+        self.assertEqual(rate_cap.reserve(5), 1)
+        rate_cap.refund(3)
+        self.assertEqual(rate_cap.reserve(5), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from ..app.services.fair_share import DeficitRoundRobin
+
+
+class Backlog:
+    def __init__(self, **sizes):
+        self.sizes = sizes
+
+    def __call__(self, name, limit):
+        count = min(limit, self.sizes[name])
+        self.sizes[name] -= count
+        return count
+
+
+class DeficitRoundRobinTestCase(unittest.TestCase):
+    def test_splits_by_weight_when_every_type_has_work(self):
+        scheduler = DeficitRoundRobin({'keyword': 1, 'source': 1, 'comment': 2})
+        sent = scheduler.schedule(100, Backlog(keyword=1000, source=1000, comment=1000))
+        self.assertEqual(sent, {'keyword': 25, 'source': 25, 'comment': 50})
+
+    def test_redistributes_unused_share(self):
+        scheduler = DeficitRoundRobin({'keyword': 1, 'source': 1, 'comment': 2})
+        sent = scheduler.schedule(100, Backlog(keyword=5, source=1000, comment=1000))
+        self.assertEqual(sent['keyword'], 5)
+        self.assertEqual(sum(sent.values()), 100)
+        self.assertGreater(sent['comment'], sent['source'])
+
+    def test_small_weights_are_served_across_ticks(self):
+        scheduler = DeficitRoundRobin({'keyword': 9, 'comment': 1})
+        backlog = Backlog(keyword=1000, comment=1000)
+        sent = [scheduler.schedule(4, backlog) for _ in range(5)]
+        self.assertEqual(sum(tick['comment'] for tick in sent), 2)
+        self.assertEqual(sum(tick['keyword'] for tick in sent), 18)
+
+    def test_zero_weight_disables_type(self):
+        scheduler = DeficitRoundRobin({'keyword': 1, 'like': 0})
+        sent = scheduler.schedule(10, Backlog(keyword=3, like=100))
+        self.assertEqual(sent, {'keyword': 3})
+
+    def test_limits_to_given_names(self):
+        scheduler = DeficitRoundRobin({'keyword': 1, 'source': 1})
+        sent = scheduler.schedule(10, Backlog(keyword=100, source=100), {'source'})
+        self.assertEqual(sent, {'source': 10})
+
+    def test_quotas_sum_to_capacity_with_negative_deficits(self):
+        scheduler = DeficitRoundRobin({'keyword': 1, 'source': 1, 'comment': 1})
+        scheduler.deficits.update(keyword=-0.9, source=-0.9, comment=-0.6)
+        quotas = scheduler.allocate(1, ['keyword', 'source', 'comment'])
+        self.assertEqual(sum(quotas.values()), 1)
+        self.assertTrue(all(quota >= 0 for quota in quotas.values()))
+        self.assertEqual(quotas['comment'], 1)
+        self.assertAlmostEqual(sum(scheduler.deficits.values()), -2.4)
+
+    def test_quotas_sum_to_capacity_with_carried_deficits(self):
+        scheduler = DeficitRoundRobin({'keyword': 1, 'source': 1})
+        scheduler.deficits.update(keyword=0.9, source=0.8)
+        self.assertEqual(scheduler.allocate(1, ['keyword', 'source']), {'keyword': 1, 'source': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
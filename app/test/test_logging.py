@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+import queue
+import unittest
+from unittest import mock
+
+from ..app.utils.logging import DroppingQueueHandler, ItemSampler, JsonFormatter, Log
+
+
+class ItemSamplerTestCase(unittest.TestCase):
+    @mock.patch('time.monotonic')
+    def test_limits_rate_and_counts_suppressed(self, monotonic):
+        monotonic.return_value = 0.0
+        sampler = ItemSampler(2)
+        self.assertEqual([sampler.allow() for _ in range(4)], [True, True, False, False])
+        self.assertEqual(sampler.suppressed, 2)
+
+        monotonic.return_value = 0.5
+        self.assertTrue(sampler.allow())
+        self.assertFalse(sampler.allow())
+
+
+class JsonFormatterTestCase(unittest.TestCase):
+    def test_formats_fields_as_one_line(self):
+        record = logging.LogRecord('fb_producer', logging.INFO, __file__, 1, 'check_tasks tick', None, None)
+        record.fields = {'keyword': 3, 'duration': 0.5}
+        line = JsonFormatter().format(record)
+        self.assertNotIn('\n', line)
+        entry = json.loads(line)
+        self.assertEqual(entry['message'], 'check_tasks tick')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['keyword'], 3)
+
+
+class LogTestCase(unittest.TestCase):
+    def test_item_reports_suppressed_count(self):
+        log = Log('fb_producer_test')
+        with mock.patch.object(log, 'write') as write, \
+                mock.patch('time.monotonic', return_value=0.0):
+            log.samplers['send_keyword'] = ItemSampler(1)
+            log.item('send_keyword', 'send keyword', task_id=1)
+            log.item('send_keyword', 'send keyword', task_id=2)
+            log.samplers['send_keyword'].tokens = 1
+            log.item('send_keyword', 'send keyword', task_id=3)
+
+        self.assertEqual(write.call_count, 2)
+        self.assertEqual(write.call_args[0][2], {'task_id': 3, 'suppressed': 1})
+
+
+class DroppingQueueHandlerTestCase(unittest.TestCase):
+    def test_counts_dropped_records(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        for index in range(3):
+            handler.emit(logging.LogRecord('fb_producer', logging.INFO, __file__, 1, 'tick', None, None))
+        self.assertEqual(handler.dropped, 2)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'fork is not available')
+    def test_writes_records_after_fork(self):
+        read_fd, write_fd = os.pipe()
+        stream = os.fdopen(write_fd, 'w')
+        target = logging.StreamHandler(stream)
+        target.setFormatter(JsonFormatter())
+        handler = DroppingQueueHandler(queue.Queue(10), target)
+        handler.emit(logging.LogRecord('fb_producer', logging.INFO, __file__, 1, 'master', None, None))
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                handler.emit(logging.LogRecord('fb_producer', logging.INFO, __file__, 1, 'worker', None, None))
+                handler.stop_listener()
+                stream.flush()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        handler.stop_listener()
+        stream.close()
+
+        with os.fdopen(read_fd) as output:
+            messages = [json.loads(line)['message'] for line in output]
+        self.assertEqual(sorted(messages), ['master', 'worker'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import threading
+import unittest
+from collections import defaultdict
+
+from celery import Celery
+
+from ..app.services.publisher import Publisher, PublishConfirms
+
+
+class PublisherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.celery = Celery('test', broker='memory://')
+        self.connection = self.celery.connection_for_read()
+        self.queue = self.connection.SimpleQueue('celery')
+
+    def tearDown(self):
+        self.queue.clear()
+        self.queue.close()
+        self.connection.release()
+
+    def received(self):
+        messages = []
+        while self.queue.qsize():
+            message = self.queue.get(timeout=1)
+            messages.append((message.headers['task'], message.payload[0]))
+            message.ack()
+        return messages
+
+    def test_buffers_until_flush_size(self):
+        publisher = Publisher(self.celery, flush_size=3, flush_interval=60)
+        publisher.publish('sub_task_post_likes', args=(1,))
+        publisher.publish('sub_task_post_likes', args=(2,))
+        self.assertEqual(self.received(), [])
+
+        publisher.publish('sub_task_post_likes', args=(3,))
+        self.assertEqual(self.received(), [
+            ('sub_task_post_likes', [1]),
+            ('sub_task_post_likes', [2]),
+            ('sub_task_post_likes', [3]),
+        ])
+        self.assertEqual(publisher.published_count, 3)
+        self.assertEqual(publisher.last_flush_size, 3)
+
+    def test_flush_sends_partial_batch(self):
+        publisher = Publisher(self.celery, flush_size=100, flush_interval=60)
+        publisher.publish('sub_task_post_comments', args=(7,), countdown=5)
+
+        self.assertEqual(publisher.flush(), 1)
+        self.assertEqual(publisher.flush(), 0)
+        self.assertEqual(self.received(), [('sub_task_post_comments', [7])])
+        self.assertEqual(publisher.unconfirmed_count, 0)
+
+    def test_send_error_keeps_unsent_messages(self):
+        publisher = Publisher(self.celery, flush_size=100, flush_interval=60)
+        for task_id in range(1, 4):
+            publisher.publish('sub_task_post_likes', args=(task_id,))
+
+        send_task = self.celery.send_task
+        calls = []
+
+        def failing_send_task(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise ConnectionError('broker is gone')
+            return send_task(*args, **kwargs)
+
+        self.celery.send_task = failing_send_task
+        self.assertEqual(publisher.flush(), 1)
+        self.assertEqual(publisher.buffer, [
+            ('sub_task_post_likes', (2,), None, {}),
+            ('sub_task_post_likes', (3,), None, {}),
+        ])
+
+        self.celery.send_task = send_task
+        self.assertEqual(publisher.flush(), 2)
+        self.assertEqual([args[0] for _, args in self.received()], [1, 2, 3])
+        self.assertEqual(publisher.published_count, 3)
+
+    def test_publish_is_not_blocked_by_flush(self):
+        publisher = Publisher(self.celery, flush_size=100, flush_interval=60)
+        publisher.publish('sub_task_post_likes', args=(1,))
+
+        send_task = self.celery.send_task
+        published = []
+
+        def send_task_with_publish(*args, **kwargs):
+            thread = threading.Thread(
+                target=lambda: published.append(publisher.publish('sub_task_post_likes', args=(2,)))
+            )
+            thread.start()
+            thread.join(timeout=5)
+            return send_task(*args, **kwargs)
+
+        self.celery.send_task = send_task_with_publish
+        self.assertEqual(publisher.flush(), 1)
+        self.assertEqual(published, [None])
+        self.assertEqual(publisher.buffer, [('sub_task_post_likes', (2,), None, {})])
+
+
+class FakeChannel:
+    def __init__(self):
+        self.is_open = True
+        self.events = defaultdict(set)
+
+    def confirm_select(self):
+        pass
+
+
+class PublishConfirmsTestCase(unittest.TestCase):
+    def test_nacked_and_unconfirmed_messages(self):
+        confirms = PublishConfirms(FakeChannel())
+        for task_id in range(1, 5):
+            confirms.published(('sub_task_post_likes', (task_id,), None, {}))
+        confirms.on_ack(1, False)
+        confirms.on_nack(3, True)
+
+        nacked, unconfirmed = confirms.reset()
+        self.assertEqual([args for _, args, _, _ in nacked], [(2,), (3,)])
+        self.assertEqual([args for _, args, _, _ in unconfirmed], [(4,)])
+        self.assertEqual(confirms.reset(), ([], []))
+
+    def test_reopened_channel_gets_new_confirms(self):
+        publisher = Publisher(Celery('test', broker='memory://'))
+        channel = FakeChannel()
+        confirms = publisher.get_confirms(channel)
+        confirms.published(('sub_task_post_likes', (1,), None, {}))
+        self.assertIs(publisher.get_confirms(channel), confirms)
+
+        channel.events.clear()
+        channel.is_open = False
+        self.assertFalse(confirms.attached(channel))
+        channel.is_open = True
+        reopened = publisher.get_confirms(channel)
+        self.assertIsNot(reopened, confirms)
+        self.assertEqual(reopened.next_delivery_tag, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from unittest import mock
+
+from ..app.database import routing
+from ..app.database.routing import ReplicaRouter
+
+
+def replica_engine(lag):
+    engine = mock.MagicMock()
+    connection = engine.connect.return_value.__enter__.return_value
+    if isinstance(lag, Exception):
+        connection.execute.side_effect = lag
+    else:
+        connection.execute.return_value.scalar.return_value = lag
+    return engine
+
+
+class ReplicaRouterTestCase(unittest.TestCase):
+    def create_router(self, lags, now):
+        engines = {uri: replica_engine(lag) for uri, lag in lags.items()}
+        patcher = mock.patch.object(routing, 'create_engine', side_effect=lambda uri, **options: engines[uri])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        router = ReplicaRouter(list(lags), max_lag=30, check_interval=5, clock=lambda: now[0])
+        return router, engines
+
+    def test_skips_lagging_and_unavailable_replicas(self):
+        now = [0.0]
+        router, engines = self.create_router(
+            {'replica-1': 120, 'replica-2': Exception('down'), 'replica-3': 2}, now)
+        self.assertEqual({router.get_engine() for _ in range(3)}, {engines['replica-3']})
+
+    def test_falls_back_to_primary_and_rechecks_after_interval(self):
+        now = [0.0]
+        router, engines = self.create_router({'replica-1': 120}, now)
+        self.assertIsNone(router.get_engine())
+
+        connection = engines['replica-1'].connect.return_value.__enter__.return_value
+        connection.execute.return_value.scalar.return_value = 0
+        self.assertIsNone(router.get_engine())
+        now[0] = 5.0
+        self.assertIs(router.get_engine(), engines['replica-1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+from ..app.services.spread import DispatchSpreader, TimingWheel
+
+
+class TimingWheelTestCase(unittest.TestCase):
+    def test_releases_items_in_their_slots(self):
+        released = []
+        wheel = TimingWheel(4, 1.0, released.append)
+        wheel.thread = mock.Mock()
+        wheel.schedule(0, 'a')
+        wheel.schedule(2.5, 'b')
+        wheel.schedule(10, 'c')
+
+        wheel.advance()
+        self.assertEqual(released, [['a']])
+        wheel.advance()
+        wheel.advance()
+        self.assertEqual(released, [['a'], ['b']])
+        wheel.advance()
+        self.assertEqual(released, [['a'], ['b'], ['c']])
+
+    def test_stop_releases_pending_items(self):
+        released = []
+        wheel = TimingWheel(4, 1.0, released.append)
+        wheel.thread = mock.Mock()
+        wheel.schedule(1, 'a')
+        wheel.schedule(3, 'b')
+        wheel.stop()
+        self.assertEqual(released, [['a', 'b']])
+
+
+class DispatchSpreaderTestCase(unittest.TestCase):
+    def test_countdown_spreads_each_task_name_over_window(self):
+        publisher = mock.Mock()
+        spreader = DispatchSpreader(publisher, 'countdown', interval=30, slots=30)
+        for subtask_id in range(3):
+            spreader.publish('sub_task_post_likes', args=(subtask_id,))
+        spreader.publish('task_keyword_id', args=(10,), priority=3)
+
+        self.assertEqual(spreader.release(30), 4)
+        self.assertEqual(publisher.publish.call_args_list, [
+            mock.call('sub_task_post_likes', args=(0,), countdown=None),
+            mock.call('sub_task_post_likes', args=(1,), countdown=10.0),
+            mock.call('sub_task_post_likes', args=(2,), countdown=20.0),
+            mock.call('task_keyword_id', args=(10,), countdown=None, priority=3),
+        ])
+
+    def test_zero_window_publishes_immediately(self):
+        publisher = mock.Mock()
+        spreader = DispatchSpreader(publisher, 'wheel', interval=30, slots=30)
+        spreader.publish('sub_task_post_likes', args=(1,))
+        spreader.publish('sub_task_post_likes', args=(2,))
+        spreader.release(0)
+        self.assertEqual(publisher.publish.call_count, 2)
+        self.assertIsNone(spreader.wheel.thread)
+
+
+if __name__ == '__main__':
+    unittest.main()
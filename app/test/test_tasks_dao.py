@@ -0,0 +1,155 @@
+import unittest
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from ..app.database import db
+from ..app.database.models import Task, TaskKeyword, TaskStatus
+from ..app.database.schema import get_unusable_indexes
+from ..app.database.tasks_dao import (bulk_create_keywords,
+                                      claim_keywords_ready_to_sent, get_page,
+                                      listing_query,
+                                      ready_task_candidates_subquery)
+from .database import DatabaseTestCase
+
+Row = namedtuple('Row', ['id', 'keyword'])
+
+
+class PageQuery:
+    """Запрос с записью вызовов вместо обращения к БД."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.filters = []
+        self.limit_value = None
+
+    def filter(self, condition):
+        self.filters.append(str(condition))
+        return self
+
+    def order_by(self, column):
+        return self
+
+    def limit(self, limit):
+        self.limit_value = limit
+        return self
+
+    def all(self):
+        return self.rows[:self.limit_value]
+
+
+class ListingQueryTestCase(unittest.TestCase):
+    def test_projects_columns_with_id_first(self):
+        query = listing_query(TaskKeyword, ['keyword', 'id'])
+        self.assertEqual([column['name'] for column in query.column_descriptions], ['id', 'keyword'])
+        self.assertNotIn('tasks_keyword.task_id', str(query))
+
+    def test_returns_models_without_columns(self):
+        query = listing_query(TaskKeyword)
+        self.assertIs(query.column_descriptions[0]['type'], TaskKeyword)
+
+    def test_full_page_points_to_next_page(self):
+        query = PageQuery([Row(3, 'a'), Row(5, 'b'), Row(8, 'c')])
+        rows, next_after_id = get_page(query, TaskKeyword.id, 1, 2)
+        self.assertEqual([row.id for row in rows], [3, 5])
+        self.assertEqual(next_after_id, 5)
+        self.assertEqual(query.filters, ['tasks_keyword.id > :id_1'])
+
+    def test_short_page_is_last(self):
+        query = PageQuery([Row(3, 'a')])
+        self.assertEqual(get_page(query, TaskKeyword.id, None, 2), ([Row(3, 'a')], None))
+        self.assertEqual(query.filters, [])
+
+
+class ReadinessTiersTestCase(DatabaseTestCase):
+    def add_task(self, priority, finished_ago, status=TaskStatus.success):
+        now = datetime.now()
+        task = Task(interval=60, received_time=now - timedelta(days=10),
+                    finish_time=now - finished_ago, status=status, enabled=True,
+                    priority=priority)
+        db.session.add(task)
+        db.session.flush()
+        return task.id
+
+    def get_tiers(self, task_ids):
+        candidates = ready_task_candidates_subquery()
+        rows = db.session.query(candidates.c.id, candidates.c.tier).filter(
+            candidates.c.id.in_(task_ids)
+        ).all()
+        return dict(rows)
+
+    def test_low_priority_task_waits_two_days_after_finish(self):
+        task_ids = {
+            'recent': self.add_task(2, timedelta(hours=36)),
+            'no_priority': self.add_task(None, timedelta(hours=36)),
+            'old': self.add_task(3, timedelta(days=3)),
+            'high': self.add_task(1, timedelta(hours=2)),
+        }
+        tiers = self.get_tiers(list(task_ids.values()))
+        self.assertEqual(tiers, {task_ids['old']: 3, task_ids['high']: 3})
+
+    def test_new_and_retry_tiers(self):
+        new_id = self.add_task(2, timedelta(days=3), status=None)
+        retry_id = self.add_task(2, timedelta(minutes=10), status=TaskStatus.retry)
+        waiting_id = self.add_task(2, timedelta(minutes=1), status=TaskStatus.retry)
+        self.assertEqual(self.get_tiers([new_id, retry_id, waiting_id]), {new_id: 1, retry_id: 2})
+
+
+class ClaimTasksTestCase(DatabaseTestCase):
+    def add_keywords(self, priority, count):
+        task_ids = []
+        for index in range(count):
+            task = Task(interval=60, enabled=True, priority=priority)
+            db.session.add(task)
+            db.session.flush()
+            db.session.add(TaskKeyword(keyword='{0}-{1}'.format(priority, index), task_id=task.id))
+            task_ids.append(task.id)
+        db.session.flush()
+        return task_ids
+
+    def test_fills_short_priority_quota_in_queue_order(self):
+        high = self.add_keywords(1, 5)
+        low = self.add_keywords(3, 5)
+        claimed = claim_keywords_ready_to_sent(5, quotas={1: 2, 2: 2, 3: 1})
+        self.assertEqual(sorted(claimed), [(task_id, 1) for task_id in high[:4]] + [(low[0], 3)])
+
+    def test_claimed_tasks_are_not_claimed_again(self):
+        task_ids = self.add_keywords(2, 3)
+        self.assertEqual(len(claim_keywords_ready_to_sent(2, quotas={2: 2})), 2)
+        self.assertEqual(claim_keywords_ready_to_sent(5, quotas={2: 5}), [(task_ids[2], 2)])
+        status = db.session.query(Task.status).filter(Task.id == task_ids[0]).scalar()
+        self.assertEqual(status, TaskStatus.in_queue)
+
+
+class BulkCreateTasksTestCase(DatabaseTestCase):
+    def test_skips_existing_and_repeated_keywords(self):
+        task = Task(interval=60, enabled=True)
+        db.session.add(task)
+        db.session.flush()
+        db.session.add(TaskKeyword(keyword='bulk-existing', task_id=task.id))
+        db.session.flush()
+
+        rows = [
+            {'keyword': 'bulk-first', 'interval': 5, 'retro': '2021-01-01', 'enabled': True},
+            {'keyword': 'bulk-second', 'interval': 10, 'retro': '2021-01-01',
+             'until': '2021-02-01', 'enabled': False},
+            {'keyword': 'bulk-first', 'interval': 15, 'retro': '2021-01-01', 'enabled': True},
+            {'keyword': 'bulk-existing', 'interval': 20, 'retro': '2021-01-01', 'enabled': True},
+        ]
+        self.assertEqual(bulk_create_keywords(rows), {'inserted': 2, 'skipped': 2})
+
+        tasks = dict(db.session.query(TaskKeyword.keyword, Task.interval).join(
+            Task, Task.id == TaskKeyword.task_id
+        ).filter(TaskKeyword.keyword.like('bulk-%')).all())
+        self.assertEqual(tasks, {'bulk-existing': 60, 'bulk-first': 5, 'bulk-second': 10})
+
+    def test_reports_missing_unique_index(self):
+        names = ['ux_tasks_keyword_keyword', 'ux_tasks_source_source_id']
+        self.assertEqual(get_unusable_indexes(names), [])
+        db.session.execute(text('DROP INDEX ux_tasks_keyword_keyword'))
+        self.assertEqual(get_unusable_indexes(names), ['ux_tasks_keyword_keyword'])
+
+
+if __name__ == '__main__':
+    unittest.main()